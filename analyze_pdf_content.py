@@ -1,17 +1,26 @@
 #!/usr/bin/env python
 """Analizza contenuto grafico dei PDF per distinguere raster vs vettoriali."""
 
-import fitz
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
-def analyze_pdf(pdf_path: Path):
-    """Analizza un PDF e mostra dettagli su immagini raster e contenuto vettoriale."""
+import fitz
+
+def analyze_pdf(pdf_path: Path) -> str:
+    """Analizza un PDF e ritorna il report su immagini raster e contenuto vettoriale.
+
+    Ritorna una stringa (invece di stampare) cosi' i worker paralleli non
+    intrecciano l'output su stdout.
+    """
     doc = fitz.open(pdf_path)
+    out = []
     
-    print(f"\n{'='*70}")
-    print(f"📄 Analisi: {pdf_path.name}")
-    print(f"{'='*70}")
-    print(f"Pagine totali: {len(doc)}\n")
+    out.append(f"\n{'='*70}")
+    out.append(f"📄 Analisi: {pdf_path.name}")
+    out.append(f"{'='*70}")
+    out.append(f"Pagine totali: {len(doc)}\n")
     
     total_raster = 0
     total_drawings = 0
@@ -21,70 +30,83 @@ def analyze_pdf(pdf_path: Path):
         
         # Immagini raster
         images = page.get_images(full=True)
-        
-        # Elementi vettoriali (drawings)
-        drawings = page.get_drawings()
-        
-        if images or drawings:
-            print(f"📑 Pagina {page_num + 1}:")
-            print(f"  🖼️  Immagini raster: {len(images)}")
+
+        # Elementi vettoriali: conta gli operatori nel content stream grezzo
+        # invece di materializzare un dict per drawing con get_drawings()
+        op_counts = Counter(
+            tok for tok in (page.read_contents() or b"").split()
+            if tok in (b"m", b"l", b"c", b"re", b"f", b"f*", b"S", b"B", b"B*")
+        )
+        n_drawings = sum(op_counts.values())
+
+        if images or n_drawings:
+            out.append(f"📑 Pagina {page_num + 1}:")
+            out.append(f"  🖼️  Immagini raster: {len(images)}")
             
             for img_idx, img in enumerate(images[:3], 1):  # Prime 3 immagini
                 xref = img[0]
                 try:
-                    img_info = doc.extract_image(xref)
-                    print(f"      #{img_idx}: {img_info['width']}x{img_info['height']}px, "
-                          f"formato={img_info['ext']}, {len(img_info['image'])/1024:.1f}KB")
+                    # Leggi i metadati dal dizionario xref senza decodificare lo stream
+                    # (extract_image decomprime l'intera immagine solo per le dimensioni)
+                    width = int(doc.xref_get_key(xref, "Width")[1])
+                    height = int(doc.xref_get_key(xref, "Height")[1])
+                    img_filter = doc.xref_get_key(xref, "Filter")[1].strip("/[]") or "raw"
+                    raw_size = len(doc.xref_stream_raw(xref) or b"")
+                    out.append(f"      #{img_idx}: {width}x{height}px, "
+                          f"filtro={img_filter}, {raw_size/1024:.1f}KB (compressi)")
                 except:
-                    print(f"      #{img_idx}: xref={xref} (errore estrazione)")
-            
-            print(f"  🎨 Elementi vettoriali: {len(drawings)}")
+                    out.append(f"      #{img_idx}: xref={xref} (errore lettura metadati)")
             
-            if drawings:
-                # Classifica tipi di elementi
-                paths = sum(1 for d in drawings if d.get('type') == 'path')
-                rects = sum(1 for d in drawings if d.get('type') in ['re', 'rect'])
-                fills = sum(1 for d in drawings if d.get('fill'))
-                strokes = sum(1 for d in drawings if d.get('stroke'))
-                
-                print(f"      - Path: {paths}, Rettangoli: {rects}")
-                print(f"      - Con riempimento: {fills}, Con bordo: {strokes}")
-            
-            print()
-        
+            out.append(f"  🎨 Elementi vettoriali: {n_drawings}")
+
+            if n_drawings:
+                paths = op_counts[b"m"] + op_counts[b"l"] + op_counts[b"c"]
+                rects = op_counts[b"re"]
+                fills = op_counts[b"f"] + op_counts[b"f*"] + op_counts[b"B"] + op_counts[b"B*"]
+                strokes = op_counts[b"S"] + op_counts[b"B"] + op_counts[b"B*"]
+
+                out.append(f"      - Path: {paths}, Rettangoli: {rects}")
+                out.append(f"      - Con riempimento: {fills}, Con bordo: {strokes}")
+
+            out.append("")
+
         total_raster += len(images)
-        total_drawings += len(drawings)
+        total_drawings += n_drawings
     
-    print(f"{'='*70}")
-    print(f"📊 TOTALE (prime {min(5, len(doc))} pagine):")
-    print(f"  🖼️  Immagini raster: {total_raster}")
-    print(f"  🎨 Elementi vettoriali: {total_drawings}")
-    print(f"{'='*70}\n")
+    out.append(f"{'='*70}")
+    out.append(f"📊 TOTALE (prime {min(5, len(doc))} pagine):")
+    out.append(f"  🖼️  Immagini raster: {total_raster}")
+    out.append(f"  🎨 Elementi vettoriali: {total_drawings}")
+    out.append(f"{'='*70}\n")
     
     doc.close()
     
     # Suggerimenti
     if total_raster > 0 and total_drawings > 100:
-        print("💡 Questo PDF contiene ENTRAMBI:")
-        print("   - Immagini raster (foto, screenshot) → estraibili con get_images()")
-        print("   - Molti elementi vettoriali (diagrammi, grafici) → servono drawings o rendering pagina\n")
+        out.append("💡 Questo PDF contiene ENTRAMBI:")
+        out.append("   - Immagini raster (foto, screenshot) → estraibili con get_images()")
+        out.append("   - Molti elementi vettoriali (diagrammi, grafici) → servono drawings o rendering pagina\n")
     elif total_raster > 0 and total_drawings < 50:
-        print("💡 Questo PDF è prevalentemente RASTER:")
-        print("   - Le immagini sono incorporate come file → get_images() funzionerà bene\n")
+        out.append("💡 Questo PDF è prevalentemente RASTER:")
+        out.append("   - Le immagini sono incorporate come file → get_images() funzionerà bene\n")
     elif total_raster == 0 and total_drawings > 0:
-        print("💡 Questo PDF è SOLO VETTORIALE:")
-        print("   - Grafici/diagrammi disegnati come path → serve pdf2image o rendering pagina\n")
+        out.append("💡 Questo PDF è SOLO VETTORIALE:")
+        out.append("   - Grafici/diagrammi disegnati come path → serve pdf2image o rendering pagina\n")
     else:
-        print("💡 PDF prevalentemente testuale con pochi elementi grafici\n")
+        out.append("💡 PDF prevalentemente testuale con pochi elementi grafici\n")
+
+    return "\n".join(out)
 
 
 if __name__ == "__main__":
     manuals_dir = Path("manuals")
     pdfs = list(manuals_dir.glob("*.pdf"))
-    
+
     if not pdfs:
         print("❌ Nessun PDF trovato in manuals/")
     else:
         print(f"\n🔍 Trovati {len(pdfs)} PDF da analizzare\n")
-        for pdf in pdfs[:3]:  # Analizza primi 3 PDF
-            analyze_pdf(pdf)
+        # Analizza i PDF in parallelo, un worker per core
+        with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+            for report in executor.map(analyze_pdf, pdfs):
+                print(report)
@@ -1,18 +1,23 @@
 from __future__ import annotations
 
+import json
 import os
+import re
+import traceback
 from typing import List, Optional
 from pathlib import Path
 
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import BackgroundTasks, FastAPI, File, UploadFile, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from openai import OpenAI
 from dotenv import load_dotenv
 from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
 
 from .ingest import IngestResult, ingest_all, ingest_pdf, generate_image_captions, save_captions, load_image_captions
-from .rag import Chunk, load_index, search, save_index
+from .rag import Chunk, add_to_index, json_loads, load_index, search, save_index
 
 app = FastAPI(title="Customer Assistant RAG")
 
@@ -70,38 +75,75 @@ class IngestResponse(BaseModel):
 
 _cached_chunks: List[Chunk] = []
 
+# Client HTTP/OpenAI condivisi: riusano il pool di connessioni tra le richieste
+_http_client = None
+_openai_client: Optional[OpenAI] = None
 
-def load_cache() -> None:
-    global _cached_chunks
-    _cached_chunks, _ = load_index()
-
-
-def build_llm_answer(question: str, context: List[str], images: List[ImageItem], full_paragraphs: List[str] = None) -> str:
-    if not OPENAI_API_KEY:
-        return "\n\n".join(context) if context else "Nessun risultato trovato."
 
-    try:
+def get_openai_client() -> OpenAI:
+    global _http_client, _openai_client
+    if _openai_client is None:
         import httpx
         # Disabilita proxies automatici per evitare conflitti
-        http_client = httpx.Client(trust_env=False)
+        _http_client = httpx.Client(
+            trust_env=False,
+            limits=httpx.Limits(max_keepalive_connections=20),
+        )
         if OPENAI_BASE_URL:
-            client = OpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL, http_client=http_client)
+            _openai_client = OpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL, http_client=_http_client)
         else:
-            client = OpenAI(api_key=OPENAI_API_KEY, http_client=http_client)
-    except Exception as e:
-        return f"Errore nella inizializzazione LLM: {str(e)}"
-    
-    # Carica le captions delle immagini
-    import json
-    from pathlib import Path
-    captions_file = Path(__file__).parent / "storage" / "image_captions.json"
-    captions = {}
-    if captions_file.exists():
-        try:
-            captions = json.loads(captions_file.read_text(encoding="utf-8"))
-        except:
-            pass
-    
+            _openai_client = OpenAI(api_key=OPENAI_API_KEY, http_client=_http_client)
+    return _openai_client
+
+
+@app.on_event("shutdown")
+def close_http_client() -> None:
+    if _http_client is not None:
+        _http_client.close()
+
+
+# Cache delle captions keyed su mtime: riparsa il JSON solo quando il file cambia
+_captions_cache: Optional[tuple] = None
+
+
+def _get_cached_captions() -> dict:
+    global _captions_cache
+    captions_file = Path(BASE_DIR) / "storage" / "image_captions.json"
+    try:
+        mtime_ns = captions_file.stat().st_mtime_ns
+    except OSError:
+        return {}
+    if _captions_cache is not None and _captions_cache[0] == mtime_ns:
+        return _captions_cache[1]
+    try:
+        captions = json_loads(captions_file.read_bytes())
+    except Exception:
+        captions = {}
+    _captions_cache = (mtime_ns, captions)
+    return captions
+
+
+_cached_embeddings = None
+
+# Cache risposta per domande ripetute; svuotata quando l'indice cambia
+_answer_cache: dict = {}
+_ANSWER_CACHE_MAX = 512
+
+
+def load_cache() -> None:
+    global _cached_chunks, _cached_embeddings
+    # La vista mmap rimpiazzata si chiude da sola (finalizer) quando anche
+    # l'ultima search in volo rilascia il riferimento: chiuderla qui in
+    # anticipo farebbe fallire le richieste concorrenti ancora in lettura
+    _cached_chunks, _cached_embeddings = load_index()
+    _answer_cache.clear()
+
+
+def build_llm_prompts(question: str, context: List[str], images: List[ImageItem], full_paragraphs: List[str] = None) -> tuple:
+    """Costruisce i prompt system/user condivisi dai percorsi sync e streaming."""
+    # Carica le captions delle immagini (cache con invalidazione su mtime)
+    captions = _get_cached_captions()
+
     # Usa full_paragraphs se disponibili (contengono le immagini embedded), altrimenti usa context
     context_text = ""
     if full_paragraphs and len(full_paragraphs) > 0:
@@ -109,7 +151,7 @@ def build_llm_answer(question: str, context: List[str], images: List[ImageItem],
         context_text = "\n\n".join(full_paragraphs) if full_paragraphs else "(nessun contenuto)"
     else:
         context_text = "\n\n".join(context) if context else "(nessun contenuto)"
-    
+
     # Crea lista immagini con captions per riferimento
     image_list_items = []
     for img in images:
@@ -136,6 +178,25 @@ def build_llm_answer(question: str, context: List[str], images: List[ImageItem],
         "ad esempio: [Tabella dei programmi di lavaggio](/static/images/beko_p23_1.png)"
     )
 
+    return system_prompt, user_prompt
+
+
+# Prefisso comune delle risposte di errore di build_llm_answer: usato per
+# riconoscerle (es. per escluderle dalla cache delle risposte)
+_LLM_ERROR_PREFIX = "Errore nella"
+
+
+def build_llm_answer(question: str, context: List[str], images: List[ImageItem], full_paragraphs: List[str] = None) -> str:
+    if not OPENAI_API_KEY:
+        return "\n\n".join(context) if context else "Nessun risultato trovato."
+
+    try:
+        client = get_openai_client()
+    except Exception as e:
+        return f"{_LLM_ERROR_PREFIX} inizializzazione LLM: {str(e)}"
+
+    system_prompt, user_prompt = build_llm_prompts(question, context, images, full_paragraphs)
+
     try:
         response = client.chat.completions.create(
             model=OPENAI_MODEL,
@@ -150,39 +211,76 @@ def build_llm_answer(question: str, context: List[str], images: List[ImageItem],
         answer = normalize_image_urls(answer, images)
         return answer
     except Exception as e:
-        import traceback
         error_detail = traceback.format_exc()
-        return f"Errore nella generazione della risposta: {str(e)}\n\nDettagli:\n{error_detail}"
+        return f"{_LLM_ERROR_PREFIX} generazione della risposta: {str(e)}\n\nDettagli:\n{error_detail}"
+
+
+def stream_llm_answer(question: str, context: List[str], images: List[ImageItem], full_paragraphs: List[str] = None):
+    """Genera la risposta token per token con stream=True.
+
+    Yielda coppie ("delta", testo) man mano che i token arrivano; come
+    ultimo elemento yielda ("answer", risposta completa normalizzata).
+    """
+    if not OPENAI_API_KEY:
+        fallback = "\n\n".join(context) if context else "Nessun risultato trovato."
+        yield ("answer", fallback)
+        return
+
+    try:
+        client = get_openai_client()
+    except Exception as e:
+        yield ("answer", f"{_LLM_ERROR_PREFIX} inizializzazione LLM: {str(e)}")
+        return
+
+    system_prompt, user_prompt = build_llm_prompts(question, context, images, full_paragraphs)
+
+    try:
+        stream = client.chat.completions.create(
+            model=OPENAI_MODEL,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt},
+            ],
+            temperature=0.2,
+            stream=True,
+        )
+        collected: List[str] = []
+        for event in stream:
+            delta = event.choices[0].delta.content if event.choices else None
+            if delta:
+                collected.append(delta)
+                yield ("delta", delta)
+        # Normalizza gli URL una volta sola sulla risposta completa
+        yield ("answer", normalize_image_urls("".join(collected), images))
+    except Exception as e:
+        yield ("answer", f"{_LLM_ERROR_PREFIX} generazione della risposta: {str(e)}")
+
+
+# Pattern: [testo](url) - compilato una volta sola, non ad ogni risposta
+_MARKDOWN_LINK_RE = re.compile(r'(\[[^\]]+\])\(([^)]+)\)')
 
 
 def normalize_image_urls(text: str, images: List[ImageItem]) -> str:
     """Corregge gli URL delle immagini nel testo dell'LLM, convertendo domini a path relativi."""
-    import re
-    
     # Estrai solo i nomi file dagli URL
     image_names = {img.url.split('/')[-1]: img.url for img in images}
     
-    # Trova tutti i link markdown [testo](url) 
+    # Trova tutti i link markdown [testo](url)
     def replace_url(match):
         prefix = match.group(1)  # [testo]
         url = match.group(2)     # url
-        
+
         # Estrai il nome file dall'URL (ultimo segmento dopo l'ultimo /)
-        filename = url.split('/')[-1]
-        
+        filename = url.rpartition('/')[-1]
+
         # Se il nome file è in images, usa l'URL corretto
-        if filename in image_names:
-            return f"{prefix}({image_names[filename]})"
-        
-        # Se l'URL non inizia con /, convertilo a path relativo
-        if not url.startswith('/') and filename in image_names:
-            return f"{prefix}({image_names[filename]})"
-        
+        corrected = image_names.get(filename)
+        if corrected is not None:
+            return f"{prefix}({corrected})"
+
         return match.group(0)
-    
-    # Pattern: [testo](url)
-    text = re.sub(r'(\[[^\]]+\])\(([^)]+)\)', replace_url, text)
-    return text
+
+    return _MARKDOWN_LINK_RE.sub(replace_url, text)
 
 
 @app.get("/health")
@@ -190,8 +288,20 @@ async def health() -> dict:
     return {"status": "ok"}
 
 
+def _finalize_upload(chunks: List[Chunk]) -> None:
+    """Completa l'ingestione in background: captions, indice e cache."""
+    # Genera captions per le nuove immagini
+    generate_image_captions()
+
+    # Appendi solo i nuovi chunk all'indice, senza riscrivere i precedenti
+    add_to_index(chunks)
+
+    # Ricarica la cache
+    load_cache()
+
+
 @app.post("/upload", response_model=IngestResponse)
-async def upload_manual(file: UploadFile = File(...)) -> IngestResponse:
+async def upload_manual(background_tasks: BackgroundTasks, file: UploadFile = File(...)) -> IngestResponse:
     """Riceve un file PDF, lo salva in manuals/, e esegue l'ingestione."""
     if not file.filename.lower().endswith('.pdf'):
         raise HTTPException(status_code=400, detail="Solo file PDF sono consentiti")
@@ -199,42 +309,30 @@ async def upload_manual(file: UploadFile = File(...)) -> IngestResponse:
     # Crea la cartella manuals se non esiste
     Path(MANUALS_DIR).mkdir(parents=True, exist_ok=True)
     
-    # Salva il file
+    # Salva il file in streaming a blocchi, senza caricare tutto il PDF in RAM
     file_path = Path(MANUALS_DIR) / file.filename
     try:
-        contents = await file.read()
-        file_path.write_bytes(contents)
+        first_chunk = True
+        with open(file_path, "wb") as out:
+            while chunk := await file.read(1 << 20):
+                if first_chunk:
+                    if not chunk.startswith(b"%PDF-"):
+                        out.close()
+                        file_path.unlink(missing_ok=True)
+                        raise HTTPException(status_code=400, detail="Il file non è un PDF valido")
+                    first_chunk = False
+                # La scrittura su disco va in threadpool per non bloccare l'event loop
+                await run_in_threadpool(out.write, chunk)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Errore nel salvataggio del file: {str(e)}")
     
-    # Esegui l'ingestione del file singolo
+    # Esegui l'ingestione del file singolo; captions e indice vengono
+    # completati in background per rispondere subito all'utente
     try:
         chunks, img_count = ingest_pdf(file_path)
-        
-        # Ricarica tutti i chunk dal disco (sia nuovi che precedenti)
-        from .rag import CHUNKS_PATH
-        all_chunks = []
-        if Path(CHUNKS_PATH).exists():
-            import json
-            with open(CHUNKS_PATH, "r", encoding="utf-8") as f:
-                for line in f:
-                    if line.strip():
-                        data = json.loads(line)
-                        from .rag import Chunk
-                        all_chunks.append(Chunk.from_json(data))
-        
-        # Aggiungi i nuovi chunk
-        all_chunks.extend(chunks)
-        
-        # Genera captions per le nuove immagini
-        generate_image_captions()
-        
-        # Salva l'indice aggiornato
-        save_index(all_chunks)
-        
-        # Ricarica la cache
-        load_cache()
-        
+        background_tasks.add_task(_finalize_upload, chunks)
         return IngestResponse(manuals=1, chunks=len(chunks), images=img_count)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Errore durante l'ingestione: {str(e)}")
@@ -245,14 +343,26 @@ async def query(payload: QueryRequest) -> QueryResponse:
     if not _cached_chunks:
         load_cache()
 
-    results = search(
-        query=payload.question,
-        chunks=_cached_chunks,
-        embeddings=None,
-        top_k=payload.top_k,
-        brand=payload.brand,
+    cache_key = (payload.question.strip().lower(), payload.brand, payload.top_k)
+    cached = _answer_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    # search e la chiamata OpenAI sono bloccanti: vanno in threadpool per non
+    # serializzare le richieste concorrenti sull'event loop
+    results = await run_in_threadpool(
+        search,
+        payload.question,
+        _cached_chunks,
+        _cached_embeddings,
+        payload.top_k,
+        payload.brand,
     )
 
+    # Nessun chunk rilevante: inutile pagare il round-trip verso l'LLM
+    if not results:
+        return QueryResponse(answer="Nessun risultato trovato.", sources=[], images=[])
+
     sources: List[SourceItem] = []
     images: List[ImageItem] = []
     context_parts: List[str] = []
@@ -277,6 +387,41 @@ async def query(payload: QueryRequest) -> QueryResponse:
         for img in chunk.images:
             images.append(ImageItem(chunk_id=chunk.id, url=img))
 
-    answer = build_llm_answer(payload.question, context_parts, images, full_paragraphs)
+    answer = await run_in_threadpool(build_llm_answer, payload.question, context_parts, images, full_paragraphs)
+
+    response = QueryResponse(answer=answer, sources=sources, images=images)
+    # Non cachare gli errori: un fallimento transitorio dell'LLM verrebbe
+    # altrimenti riproposto a ogni query identica fino al prossimo reindex
+    if not answer.startswith(_LLM_ERROR_PREFIX):
+        if len(_answer_cache) >= _ANSWER_CACHE_MAX:
+            _answer_cache.clear()
+        _answer_cache[cache_key] = response
+    return response
+
+
+@app.post("/query/stream")
+async def query_stream(payload: QueryRequest) -> StreamingResponse:
+    """Variante streaming di /query: emette i token via server-sent events."""
+    if not _cached_chunks:
+        load_cache()
+
+    results = await run_in_threadpool(
+        search,
+        payload.question,
+        _cached_chunks,
+        _cached_embeddings,
+        payload.top_k,
+        payload.brand,
+    )
+
+    context_parts = [chunk.text for chunk, _ in results]
+    full_paragraphs = [chunk.full_paragraph for chunk, _ in results if chunk.full_paragraph]
+    images = [ImageItem(chunk_id=chunk.id, url=img) for chunk, _ in results for img in chunk.images]
+
+    def event_stream():
+        for kind, text in stream_llm_answer(payload.question, context_parts, images, full_paragraphs):
+            payload_json = json.dumps({kind: text}, ensure_ascii=False)
+            yield f"data: {payload_json}\n\n"
+        yield "data: [DONE]\n\n"
 
-    return QueryResponse(answer=answer, sources=sources, images=images)
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
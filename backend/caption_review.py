@@ -2,6 +2,7 @@ from __future__ import annotations
 
 import json
 import os
+import re
 from pathlib import Path
 
 BASE_DIR = Path(__file__).resolve().parent
@@ -9,11 +10,14 @@ STORAGE_DIR = BASE_DIR / "storage"
 IMAGES_DIR = STORAGE_DIR / "images"
 CAPTIONS_FILE = STORAGE_DIR / "image_captions.json"
 
-FALLBACK_CAPTIONS = {
+FALLBACK_CAPTIONS = frozenset({
     "Immagine del manuale",
     "Immagine illustrativa",
     "Non disponibile",
-}
+})
+
+# Termini vaghi in un'unica alternation compilata: una sola scansione C-level
+_VAGUE_RE = re.compile(r"non disponibile|superficie|gradiente|manuale")
 
 
 def load_captions() -> dict[str, str]:
@@ -43,9 +47,7 @@ def needs_caption(url: str, captions: dict[str, str]) -> bool:
     if value in FALLBACK_CAPTIONS:
         return True
 
-    lower_value = value.lower()
-    vague_terms = ["non disponibile", "superficie", "gradiente", "manuale"]
-    return any(term in lower_value for term in vague_terms)
+    return bool(_VAGUE_RE.search(value.lower()))
 
 
 def prompt_caption(image_url: str) -> str:
@@ -1,22 +1,91 @@
 from __future__ import annotations
 
 import argparse
+import atexit
 import base64
+import hashlib
 import html
+import io
 import json
 import logging
 import os
 import re
 import shutil
+import struct
+import threading
 import time
 import uuid
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed, wait
+from contextlib import contextmanager
 from dataclasses import dataclass
+from functools import lru_cache
+from logging.handlers import MemoryHandler
 from pathlib import Path
-from typing import Dict, Iterable, List, Tuple
+from typing import Dict, Iterable, Iterator, List, Tuple
 
-import pdfplumber
+import numpy as np
+
+from .rag import Chunk, add_to_index, save_index
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# R-tree opzionale per il clustering spaziale dei vettoriali: se manca si
+# ricade sulla scansione lineare dei cluster
+try:
+    from rtree import index as rtree_index
+except ImportError:
+    rtree_index = None
+
+# lxml opzionale per il parse HTML in streaming; senza si usa BeautifulSoup
+try:
+    from lxml import etree as lxml_etree
+except ImportError:
+    lxml_etree = None
+
+# Pool condiviso per le scritture su disco delle immagini: creato pigramente
+# così i worker che non estraggono immagini non avviano thread
+_io_pool: ThreadPoolExecutor | None = None
+
+
+def _get_io_pool() -> ThreadPoolExecutor:
+    global _io_pool
+    if _io_pool is None:
+        _io_pool = ThreadPoolExecutor(max_workers=4)
+    return _io_pool
+
+
+def _fast_write(path: Path, data: bytes) -> None:
+    """Scrittura one-shot via os.write.
+
+    Salta il BufferedWriter di open("wb"): open/write/close diretti, un
+    livello di buffering e un flush in meno per ognuna delle migliaia di
+    piccole immagini scritte durante l'ingestione."""
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        os.write(fd, data)
+    finally:
+        os.close(fd)
+
+
+@contextmanager
+def open_pdf(path: Path):
+    """Apre un PDF con PyMuPDF garantendo la chiusura del documento.
+
+    Un'unica apertura per passaggio: il parsing della xref table dei manuali
+    grossi si paga una volta sola e l'handle viene condiviso dai passi che
+    ricevono il documento come argomento."""
+    import fitz
+
+    doc = fitz.open(path)
+    try:
+        yield doc
+    finally:
+        doc.close()
 
-from .rag import Chunk, save_index
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 STORAGE_DIR = Path(__file__).resolve().parent / "storage"
@@ -25,9 +94,25 @@ HTML_DIR = STORAGE_DIR / "html"
 
 BRANDS = {"aspirapolvere", "condizionatore", "congelatore", "lavastoviglie", "lavatrice", "microonde", "plasma"}
 
+# Alternation compilata: una sola scansione C-level del nome file invece di
+# un substring-check Python per ogni brand
+_BRAND_RE = re.compile("|".join(map(re.escape, sorted(BRANDS))), re.IGNORECASE)
+
+# Regex compilate una volta sola: questi pattern girano per ogni riga di
+# ogni chunk, la ricompilazione per chiamata dominerebbe il costo
+_TITLE_RE = re.compile(r"^\d+(?:\.\d+)*\.?\s+.+")
+# Classificatore bulk per build_html: una sola finditer multiline su tutto
+# il chunk invece di un match per riga; lo strip è inglobato nel pattern
+_CHUNK_LINE_RE = re.compile(
+    r"^[ \t]*(?P<line>(?:(?P<heading>\d+\.(?:\d+\.)*[ \t])|(?P<bullet>[-•*][ \t]+))?(?P<rest>.*?))[ \t\r]*$",
+    re.MULTILINE,
+)
+_WS_RE = re.compile(r"\s+")
+
 LOG_DIR = STORAGE_DIR / "logs"
 LOG_FILE = LOG_DIR / "ingest.log"
 CAPTIONS_FILE = STORAGE_DIR / "image_captions.json"
+IMG_HASHES_FILE = STORAGE_DIR / "image_hashes.json"
 
 LOG_DIR.mkdir(parents=True, exist_ok=True)
 
@@ -36,13 +121,19 @@ logging.basicConfig(
     format="%(asctime)s | %(levelname)s | %(message)s",
 )
 logger = logging.getLogger("ingest")
-logger.setLevel(logging.DEBUG)
+# DEBUG solo su richiesta esplicita: i debug nei loop caldi (per immagine,
+# per cluster) passano comunque dal lock del modulo logging
+logger.setLevel(logging.DEBUG if os.getenv("INGEST_DEBUG") == "1" else logging.INFO)
 
-file_handler = logging.FileHandler(LOG_FILE, encoding="utf-8")
+file_handler = logging.FileHandler(LOG_FILE, encoding="utf-8", delay=True)
 file_handler.setLevel(logging.INFO)
 file_formatter = logging.Formatter("%(asctime)s | %(levelname)s | %(message)s")
 file_handler.setFormatter(file_formatter)
-logger.addHandler(file_handler)
+# Scritture su file coalescenti: il MemoryHandler accumula fino a 1000
+# record e flusha sui WARNING o a fine processo
+memory_handler = MemoryHandler(1000, flushLevel=logging.WARNING, target=file_handler)
+logger.addHandler(memory_handler)
+atexit.register(memory_handler.flush)
 
 
 @dataclass
@@ -52,40 +143,118 @@ class IngestResult:
     images: int
 
 
+@dataclass(slots=True)
+class ImageIndex:
+    """Indice compatto pagina -> URL immagine in formato SoA.
+
+    Un'unica stringa con tutti gli URL concatenati, affettata da un array di
+    offset, più un array parallelo (ordinato) di numeri di pagina: tre
+    oggetti in tutto invece di migliaia di piccole liste e stringhe Python,
+    e molto più economico da picklare tra processi. Espone il sottoinsieme
+    di interfaccia dict usato dai consumer (get, in, [], values).
+    """
+
+    page_ids: np.ndarray  # int32, una voce per URL, ordinato per pagina
+    offsets: np.ndarray  # int32, len == n_url + 1
+    url_blob: str
+
+    @classmethod
+    def from_dict(cls, images_by_page: Dict[int, List[str]]) -> "ImageIndex":
+        page_ids: List[int] = []
+        parts: List[str] = []
+        offsets = [0]
+        total = 0
+        for page in sorted(images_by_page):
+            for url in images_by_page[page]:
+                page_ids.append(page)
+                parts.append(url)
+                total += len(url)
+                offsets.append(total)
+        return cls(
+            np.asarray(page_ids, dtype=np.int32),
+            np.asarray(offsets, dtype=np.int32),
+            "".join(parts),
+        )
+
+    def for_page(self, page: int) -> List[str]:
+        lo = int(np.searchsorted(self.page_ids, page, side="left"))
+        hi = int(np.searchsorted(self.page_ids, page, side="right"))
+        return [self.url_blob[self.offsets[i]:self.offsets[i + 1]] for i in range(lo, hi)]
+
+    def get(self, page: int, default: List[str] | None = None) -> List[str]:
+        urls = self.for_page(page)
+        if urls:
+            return urls
+        return default if default is not None else []
+
+    def __contains__(self, page: int) -> bool:
+        lo = int(np.searchsorted(self.page_ids, page, side="left"))
+        return lo < len(self.page_ids) and int(self.page_ids[lo]) == page
+
+    def __getitem__(self, page: int) -> List[str]:
+        return self.for_page(page)
+
+    def values(self) -> Iterator[List[str]]:
+        for page in np.unique(self.page_ids):
+            yield self.for_page(int(page))
+
+    def to_dict(self) -> Dict[int, List[str]]:
+        """Adapter per i chiamanti legacy che vogliono il dict esplicito."""
+        result: Dict[int, List[str]] = {}
+        for i, page in enumerate(self.page_ids):
+            result.setdefault(int(page), []).append(self.url_blob[self.offsets[i]:self.offsets[i + 1]])
+        return result
+
+
 def infer_brand(file_name: str) -> str:
-    lower = file_name.lower()
-    for brand in BRANDS:
-        if brand in lower:
-            return brand
-    return "unknown"
+    match = _BRAND_RE.search(file_name)
+    return match.group(0).lower() if match else "unknown"
 
 
-def list_manual_pdfs() -> List[Path]:
+@lru_cache(maxsize=1)
+def _list_pdfs_cached(mtime_key: Tuple[int, int]) -> Tuple[Path, ...]:
+    # scandir + test di suffisso: niente fnmatch per entry come con glob
     candidates: List[Path] = []
     manuals_dir = BASE_DIR / "manuals"
-    if manuals_dir.exists():
-        candidates.extend(manuals_dir.glob("*.pdf"))
-    candidates.extend(BASE_DIR.glob("*.pdf"))
-    unique = {p.resolve() for p in candidates if p.is_file()}
-    return sorted(unique)
+    for directory in (manuals_dir, BASE_DIR):
+        if not directory.exists():
+            continue
+        for entry in os.scandir(directory):
+            if entry.is_file() and entry.name.lower().endswith(".pdf"):
+                candidates.append(Path(entry.path))
+    unique = {p.resolve() for p in candidates}
+    return tuple(sorted(unique))
+
 
+def list_manual_pdfs() -> List[Path]:
+    """Lista dei PDF dei manuali, cacheata finché le directory non cambiano.
 
-def chunk_text(text: str, size: int = 1000, overlap: int = 0) -> List[str]:
-    logger.debug("chunk_text: inizio normalizzazione")
+    La chiave di cache è la coppia di mtime delle due directory scandite:
+    le chiamate ripetute nello stesso run non rifanno syscall finché
+    nessun PDF viene aggiunto o rimosso."""
+    manuals_dir = BASE_DIR / "manuals"
+    mtime_key = (
+        manuals_dir.stat().st_mtime_ns if manuals_dir.exists() else 0,
+        BASE_DIR.stat().st_mtime_ns,
+    )
+    return list(_list_pdfs_cached(mtime_key))
+
+
+def chunk_text(text: str, size: int = 1000, overlap: int = 0) -> Iterator[str]:
     if not text or not text.strip():
-        return []
+        return
 
-    title_pattern = re.compile(r"^\d+(?:\.\d+)*\.?\s+.+")
-    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    # walrus: una sola strip per riga
+    lines = [s for line in text.splitlines() if (s := line.strip())]
 
     paragraphs: List[str] = []
     current: List[str] = []
     pending_title = ""
 
     for line in lines:
-        if title_pattern.match(line):
+        if _TITLE_RE.match(line):
             if current:
-                paragraph_text = " ".join(current).strip()
+                paragraph_text = " ".join(current)
                 if pending_title:
                     paragraph_text = f"{pending_title}\n{paragraph_text}"
                     pending_title = ""
@@ -95,15 +264,16 @@ def chunk_text(text: str, size: int = 1000, overlap: int = 0) -> List[str]:
             continue
 
         # Se il titolo è spezzato su più righe, unisci la riga successiva
-        if pending_title and not current and not title_pattern.match(line):
-            if len(line) <= 60 or (line and line[0].islower()):
-                pending_title = f"{pending_title} {line}".strip()
+        # (una riga-titolo avrebbe già preso il ramo sopra: niente re-match)
+        if pending_title and not current:
+            if len(line) <= 60 or line[:1].islower():
+                pending_title = f"{pending_title} {line}"
                 continue
 
         current.append(line)
 
     if current:
-        paragraph_text = " ".join(current).strip()
+        paragraph_text = " ".join(current)
         if pending_title:
             paragraph_text = f"{pending_title}\n{paragraph_text}"
             pending_title = ""
@@ -113,64 +283,91 @@ def chunk_text(text: str, size: int = 1000, overlap: int = 0) -> List[str]:
 
     # Fallback: se non abbiamo paragrafi, normalizza tutto
     if not paragraphs:
-        normalized = re.sub(r"\s+", " ", text).strip()
-        return [normalized] if normalized else []
+        normalized = _WS_RE.sub(" ", text).strip()
+        if normalized:
+            yield normalized
+        return
 
-    chunks: List[str] = []
-    buffer = ""
+    # Finestra scorrevole sui paragrafi: i pezzi restano in una deque e il
+    # join avviene solo al flush (lineare), niente concatenazione quadratica
+    stride = max(1, size - overlap)
+    buf_parts: deque = deque()
+    buf_len = 0
+    emitted = 0
 
     for paragraph in paragraphs:
         if not paragraph:
             continue
 
         if len(paragraph) > size:
-            if buffer:
-                chunks.append(buffer.strip())
-                buffer = ""
+            if buf_parts:
+                yield "\n\n".join(buf_parts)
+                emitted += 1
+                buf_parts.clear()
+                buf_len = 0
             # Mantieni il titolo con il testo successivo quando possibile
             if "\n" in paragraph:
                 title_line, body = paragraph.split("\n", 1)
                 title_line = title_line.strip()
                 body = body.strip()
                 if len(title_line) + 1 < size:
-                    start = 0
                     first_chunk = f"{title_line}\n"
                     remaining_space = size - len(first_chunk)
                     first_piece = body[:remaining_space].strip()
                     if first_piece:
-                        chunks.append(first_chunk + first_piece)
-                    start = remaining_space
-                    while start < len(body):
-                        end = min(start + size, len(body))
-                        piece = body[start:end].strip()
+                        yield first_chunk + first_piece
+                        emitted += 1
+                    # Finestre (size, stride) direttamente sul corpo: solo
+                    # aritmetica di indici, nessuna stringa intermedia
+                    for i in range(remaining_space, len(body), stride):
+                        piece = body[i:i + size].strip()
                         if piece:
-                            chunks.append(piece)
-                        start = end
+                            yield piece
+                            emitted += 1
                 else:
-                    chunks.append(paragraph[:size].strip())
+                    yield paragraph[:size].strip()
+                    emitted += 1
             else:
-                start = 0
-                while start < len(paragraph):
-                    end = min(start + size, len(paragraph))
-                    piece = paragraph[start:end].strip()
+                for i in range(0, len(paragraph), stride):
+                    piece = paragraph[i:i + size].strip()
                     if piece:
-                        chunks.append(piece)
-                    start = end
+                        yield piece
+                        emitted += 1
             continue
 
-        candidate = f"{buffer}\n\n{paragraph}" if buffer else paragraph
-        if len(candidate) <= size:
-            buffer = candidate
+        candidate_len = buf_len + (2 if buf_parts else 0) + len(paragraph)
+        if candidate_len <= size:
+            buf_parts.append(paragraph)
+            buf_len = candidate_len
         else:
-            if buffer:
-                chunks.append(buffer.strip())
-            buffer = paragraph
-
-    if buffer:
-        chunks.append(buffer.strip())
-
-    logger.debug("chunk_text: fine - %d chunk creati", len(chunks))
-    return chunks
+            if buf_parts:
+                flushed = "\n\n".join(buf_parts)
+                yield flushed
+                emitted += 1
+                buf_parts.clear()
+                buf_len = 0
+                if overlap > 0:
+                    # Conserva una coda della finestra appena emessa come
+                    # contesto di overlap per la successiva, agganciata al
+                    # primo spazio per non spezzare un token a metà
+                    tail = flushed[-overlap:]
+                    cut = tail.find(" ")
+                    if 0 <= cut < len(tail) - 1:
+                        tail = tail[cut + 1:]
+                    tail = tail.strip()
+                    if tail:
+                        buf_parts.append(tail)
+                        buf_len = len(tail)
+            buf_len += (2 if buf_parts else 0) + len(paragraph)
+            buf_parts.append(paragraph)
+
+    # Non perdere l'ultima finestra parziale
+    if buf_parts:
+        yield "\n\n".join(buf_parts)
+        emitted += 1
+
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("chunk_text: fine - %d chunk creati", emitted)
 
 
 def extract_vector_graphics_as_images(page, page_num: int, pdf_path: Path, brand: str) -> List[str]:
@@ -182,45 +379,92 @@ def extract_vector_graphics_as_images(page, page_num: int, pdf_path: Path, brand
         return []
     
     # Raggruppa drawings per prossimità (clustering semplice)
-    clusters = []
-    for drawing in drawings:
-        rect = drawing.get("rect")
-        if not rect:
-            continue
-        
-        # Cerca cluster esistente vicino
-        merged = False
-        for cluster in clusters:
-            cluster_rect = cluster["rect"]
-            # Espandi leggermente per catturare elementi vicini
-            expanded = fitz.Rect(
-                cluster_rect.x0 - 5, cluster_rect.y0 - 5,
-                cluster_rect.x1 + 5, cluster_rect.y1 + 5
-            )
-            if expanded.intersects(rect) or expanded.contains(rect):
-                cluster["rect"] = cluster_rect | rect  # Union dei rect
+    if hasattr(page, "cluster_drawings"):
+        # MuPDF >= 1.22 espone lo stesso union-find in C: la tolleranza di
+        # 5px corrisponde 1:1 all'espansione del rect nel ciclo Python
+        cluster_rects = page.cluster_drawings(drawings=drawings, x_tolerance=5, y_tolerance=5)
+        clusters = [{"rect": rect, "count": 1} for rect in cluster_rects]
+    elif rtree_index is not None and len(drawings) >= 32:
+        # Indice R-tree: interroga solo i cluster candidati in ~log(C) invece
+        # di scandire linearmente tutti i cluster per ogni drawing. I bbox
+        # indicizzati sono già espansi di 5px, quindi la query con il rect
+        # del drawing equivale al test intersects/contains del ciclo lineare.
+        # Cluster in un dict keyed su id intero: cancellazioni O(1).
+        spatial = rtree_index.Index()
+        cluster_map: Dict[int, dict] = {}
+        next_id = 0
+        for drawing in drawings:
+            rect = drawing.get("rect")
+            if not rect:
+                continue
+
+            hits = list(spatial.intersection((rect.x0, rect.y0, rect.x1, rect.y1)))
+            if hits:
+                cid = hits[0]
+                cluster = cluster_map[cid]
+                old_rect = cluster["rect"]
+                spatial.delete(cid, (old_rect.x0 - 5, old_rect.y0 - 5, old_rect.x1 + 5, old_rect.y1 + 5))
+                cluster["rect"] = old_rect | rect  # Union dei rect
                 cluster["count"] += 1
-                merged = True
-                break
-        
-        if not merged:
-            clusters.append({"rect": rect, "count": 1})
+                new_rect = cluster["rect"]
+                spatial.insert(cid, (new_rect.x0 - 5, new_rect.y0 - 5, new_rect.x1 + 5, new_rect.y1 + 5))
+            else:
+                cluster_map[next_id] = {"rect": rect, "count": 1}
+                spatial.insert(next_id, (rect.x0 - 5, rect.y0 - 5, rect.x1 + 5, rect.y1 + 5))
+                next_id += 1
+        clusters = list(cluster_map.values())
+    else:
+        # Pagine con pochi drawings (o rtree assente): il setup dell'indice
+        # costerebbe più della scansione lineare
+        clusters = []
+        for drawing in drawings:
+            rect = drawing.get("rect")
+            if not rect:
+                continue
+
+            # Cerca cluster esistente vicino
+            merged = False
+            for cluster in clusters:
+                cluster_rect = cluster["rect"]
+                # Espandi leggermente per catturare elementi vicini
+                expanded = fitz.Rect(
+                    cluster_rect.x0 - 5, cluster_rect.y0 - 5,
+                    cluster_rect.x1 + 5, cluster_rect.y1 + 5
+                )
+                if expanded.intersects(rect) or expanded.contains(rect):
+                    cluster["rect"] = cluster_rect | rect  # Union dei rect
+                    cluster["count"] += 1
+                    merged = True
+                    break
+
+            if not merged:
+                clusters.append({"rect": rect, "count": 1})
     
     # Filtra cluster troppo piccoli (probabilmente decorazioni)
     MIN_SIZE = 50  # pixel
     MIN_AREA = 2500  # pixel quadrati
-    
-    significant_clusters = [
-        c for c in clusters 
-        if (c["rect"].width >= MIN_SIZE and c["rect"].height >= MIN_SIZE) 
-        or (c["rect"].width * c["rect"].height >= MIN_AREA)
-    ]
+
+    if clusters:
+        # Confronti vettorizzati su un array (C, 4) invece di attribute
+        # lookup su fitz.Rect per ogni cluster nell'interprete
+        bboxes = np.fromiter(
+            (coord for c in clusters for coord in (c["rect"].x0, c["rect"].y0, c["rect"].x1, c["rect"].y1)),
+            dtype=np.float32,
+        ).reshape(-1, 4)
+        widths = bboxes[:, 2] - bboxes[:, 0]
+        heights = bboxes[:, 3] - bboxes[:, 1]
+        mask = ((widths >= MIN_SIZE) & (heights >= MIN_SIZE)) | (widths * heights >= MIN_AREA)
+        significant_clusters = [clusters[i] for i in np.nonzero(mask)[0]]
+    else:
+        significant_clusters = []
     
     logger.debug("Pagina %d: %d drawings → %d clusters → %d significativi", 
                 page_num, len(drawings), len(clusters), len(significant_clusters))
     
     # Rendi ogni cluster come immagine
     extracted_images = []
+    pending: List[Future] = []
+    io_pool = _get_io_pool()
     for idx, cluster in enumerate(significant_clusters, start=1):
         rect = cluster["rect"]
         
@@ -243,100 +487,189 @@ def extract_vector_graphics_as_images(page, page_num: int, pdf_path: Path, brand
             # Rendi la porzione di pagina (senza matrix per evitare overflow)
             pix = page.get_pixmap(clip=clip_rect, alpha=False)
             
-            # Salva immagine
-            img_name = f"{brand}_{pdf_path.stem}_p{page_num}_vec{idx}.png"
-            img_path = IMAGES_DIR / img_name
-            pix.save(str(img_path))
-            
-            img_url = f"/static/images/{img_name}"
+            # Salva immagine: l'encoding PNG (tobytes rilascia il GIL in
+            # MuPDF) e la scrittura vanno al pool I/O, sovrapposti al
+            # rendering del cluster successivo; il dedup per contenuto evita
+            # di riscrivere cluster identici già visti
+            data = pix.tobytes("png")
+            digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+            hashes = _get_image_hash_store()
+            img_url = hashes.data.get(digest)
+            if img_url is None:
+                img_name = f"{brand}_{pdf_path.stem}_p{page_num}_vec{idx}.png"
+                img_path = IMAGES_DIR / img_name
+                pending.append(io_pool.submit(_fast_write, img_path, data))
+                img_url = f"/static/images/{img_name}"
+                hashes.set(digest, img_url)
+                hashes.maybe_flush()
             extracted_images.append(img_url)
             
             logger.debug("  Estratto vettoriale %d: %dx%d px → %s", 
-                        idx, int(rect.width), int(rect.height), img_name)
+                        idx, int(rect.width), int(rect.height), img_url)
         except Exception as e:
             logger.warning("  Errore rendering vettoriale %d: %s", idx, str(e))
             continue
     
+    if pending:
+        wait(pending)
     return extracted_images
 
 
-def pdf_to_html_with_images(pdf_path: Path) -> Tuple[str, Path, Dict[int, List[str]]]:
-    """Converte PDF a HTML ed estrae immagini (raster + vettoriali). Ritorna (html_content, html_file, images_by_page)"""
+def _process_page_range(pdf_path_str: str, brand: str, start: int, end: int) -> List[Tuple[int, str, List[str]]]:
+    """Worker: elabora le pagine [start, end) di un PDF e ritorna (pagina, html, url immagini).
+
+    Funzione top-level (picklabile) così ProcessPoolExecutor può distribuire
+    intervalli di pagine su più core; ogni worker apre la propria copia del
+    documento. Le immagini raster sono deduplicate per xref dentro il worker
+    e per content-hash tra worker, quindi lo stesso oggetto (logo, header
+    ripetuto) viene scritto su disco una volta sola; il nome file resta
+    quello storico basato su pagina e indice, la chiave delle captions.
+    """
     import fitz
-    
-    html_dir = Path("backend/storage/html")
-    html_dir.mkdir(parents=True, exist_ok=True)
-    IMAGES_DIR.mkdir(parents=True, exist_ok=True)
-    
-    html_file = html_dir / f"{pdf_path.stem}_raw.html"
-    
-    try:
-        
-        html_parts = []
-        html_parts.append("<!DOCTYPE html>")
-        html_parts.append("<html>")
-        html_parts.append("<head>")
-        html_parts.append(f"<title>{pdf_path.stem}</title>")
-        html_parts.append('<meta charset="UTF-8">')
-        html_parts.append("</head>")
-        html_parts.append("<body>")
-        
-        doc = fitz.open(pdf_path)
-        logger.info("Apertura PDF: %s - %d pagine", pdf_path.name, len(doc))
-        
-        images_by_page = {}
-        brand = infer_brand(pdf_path.name)
-        
-        for page_num in range(len(doc)):
+
+    pdf_path = Path(pdf_path_str)
+    results: List[Tuple[int, str, List[str]]] = []
+    pending: List[Future] = []
+    io_pool = _get_io_pool()
+    # xref -> URL per le ripetizioni dentro l'intervallo di questo worker
+    xref_urls: Dict[int, str] = {}
+
+    with fitz.open(pdf_path_str) as doc:
+        for page_num in range(start, end):
             page = doc[page_num]
             page_index = page_num + 1
-            
-            html_parts.append(f'<a name="page{page_index}"></a>')
-            html_parts.append(f"<h2>Pagina {page_index}</h2>")
-            
-            # Estrai testo HTML
-            page_html = page.get_text("html")
-            html_parts.append(page_html)
-            
+
+            parts = [
+                f'<a name="page{page_index}"></a>',
+                f"<h2>Pagina {page_index}</h2>",
+                page.get_text("html"),
+            ]
+            page_urls: List[str] = []
+
             # 1. Estrai immagini RASTER
-            image_list = page.get_images(full=True)
-            for img_index, img_info in enumerate(image_list, start=1):
+            for img_index, img_info in enumerate(page.get_images(full=True), start=1):
                 xref = img_info[0]
+                # Stesso oggetto già visto da questo worker: riusa l'URL
+                # senza riestrarre né rihashare i bytes
+                cached_url = xref_urls.get(xref)
+                if cached_url is not None:
+                    page_urls.append(cached_url)
+                    parts.append(f'<img src="{cached_url}" alt="Immagine raster {img_index}" />')
+                    continue
                 try:
                     base_image = doc.extract_image(xref)
                     image_bytes = base_image["image"]
-                    image_ext = base_image["ext"]
-                    
-                    img_name = f"{brand}_{pdf_path.stem}_p{page_index}_img{img_index}.{image_ext}"
-                    img_path = IMAGES_DIR / img_name
-                    
-                    img_path.write_bytes(image_bytes)
-                    
-                    img_url = f"/static/images/{img_name}"
-                    images_by_page.setdefault(page_index, []).append(img_url)
-                    
-                    html_parts.append(f'<img src="{img_url}" alt="Immagine raster {img_index}" />')
-                    
-                    logger.debug("Immagine raster: %s (pag %d)", img_name, page_index)
+
+                    # Dedup per contenuto: lo stesso logo/icona ripetuto in
+                    # PDF o pagine diverse riusa l'URL già scritto. Il nome
+                    # resta quello storico con pagina/indice (vince il primo
+                    # scrittore): è la chiave di image_captions.json e il
+                    # riferimento usato nella revisione manuale
+                    digest = hashlib.blake2b(image_bytes, digest_size=16).hexdigest()
+                    hashes = _get_image_hash_store()
+                    img_url = hashes.data.get(digest)
+                    if img_url is None:
+                        img_name = f"{brand}_{pdf_path.stem}_p{page_index}_img{img_index}.{base_image['ext']}"
+                        img_path = IMAGES_DIR / img_name
+                        if not img_path.exists():
+                            # Bytes già codificati (niente re-encoding): la
+                            # scrittura si sovrappone al parse della pagina dopo
+                            pending.append(io_pool.submit(_fast_write, img_path, image_bytes))
+                        img_url = f"/static/images/{img_name}"
+                        hashes.set(digest, img_url)
+                        hashes.maybe_flush()
+
+                    xref_urls[xref] = img_url
+                    page_urls.append(img_url)
+                    parts.append(f'<img src="{img_url}" alt="Immagine raster {img_index}" />')
+
+                    logger.debug("Immagine raster: %s (pag %d)", img_url, page_index)
                 except Exception as e:
                     logger.warning("Errore estrazione raster xref=%d pag %d: %s", xref, page_index, str(e))
-            
+
             # 2. Estrai elementi VETTORIALI
             vector_images = extract_vector_graphics_as_images(page, page_index, pdf_path, brand)
             for vec_url in vector_images:
-                images_by_page.setdefault(page_index, []).append(vec_url)
-                html_parts.append(f'<img src="{vec_url}" alt="Grafico vettoriale" />')
-            
-            if page_index % 5 == 0:
-                total_imgs = sum(len(v) for v in images_by_page.values())
-                logger.info("Processata pagina %d/%d (%d immagini totali)", page_index, len(doc), total_imgs)
-        
-        doc.close()
-        
-        html_parts.append("</body>")
-        html_parts.append("</html>")
-        
-        html_content = "\n".join(html_parts)
+                page_urls.append(vec_url)
+                parts.append(f'<img src="{vec_url}" alt="Grafico vettoriale" />')
+
+            results.append((page_index, "\n".join(parts), page_urls))
+
+    if pending:
+        wait(pending)
+    return results
+
+
+def pdf_to_html_with_images(pdf_path: Path) -> Tuple[str, Path, Dict[int, List[str]]]:
+    """Converte PDF a HTML ed estrae immagini (raster + vettoriali). Ritorna (html_content, html_file, images_by_page)"""
+    html_dir = Path("backend/storage/html")
+    html_dir.mkdir(parents=True, exist_ok=True)
+    IMAGES_DIR.mkdir(parents=True, exist_ok=True)
+
+    html_file = html_dir / f"{pdf_path.stem}_raw.html"
+
+    try:
+
+        # Accumula il documento in uno StringIO: niente lista intermedia
+        # da ri-attraversare con un join finale
+        buf = io.StringIO()
+        emit = buf.write
+        for fragment in (
+            "<!DOCTYPE html>",
+            "<html>",
+            "<head>",
+            f"<title>{pdf_path.stem}</title>",
+            '<meta charset="UTF-8">',
+            "</head>",
+            "<body>",
+        ):
+            emit(fragment)
+            emit("\n")
+
+        with open_pdf(pdf_path) as doc:
+            page_count = len(doc)
+        logger.info("Apertura PDF: %s - %d pagine", pdf_path.name, page_count)
+
+        brand = infer_brand(pdf_path.name)
+        workers = min(os.cpu_count() or 1, 6)
+
+        # Dentro un worker del pool per-PDF di ingest_all niente pool
+        # annidato: 6x6 processi fitz saturerebbero CPU e memoria
+        import multiprocessing
+
+        in_worker = multiprocessing.parent_process() is not None
+
+        if page_count >= 4 and workers > 1 and not in_worker:
+            # Distribuisci intervalli di pagine sui core: ogni worker apre il
+            # documento una volta sola e processa il proprio intervallo
+            from concurrent.futures import ProcessPoolExecutor
+
+            step = max(1, -(-page_count // (workers * 4)))
+            ranges = [(i, min(i + step, page_count)) for i in range(0, page_count, step)]
+            page_results: List[Tuple[int, str, List[str]]] = []
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [
+                    executor.submit(_process_page_range, str(pdf_path), brand, r_start, r_end)
+                    for r_start, r_end in ranges
+                ]
+                for future in futures:
+                    page_results.extend(future.result())
+        else:
+            # PDF piccoli (o siamo già in un worker): percorso seriale
+            page_results = _process_page_range(str(pdf_path), brand, 0, page_count)
+
+        # Ricomponi l'HTML nell'ordine originale delle pagine
+        page_results.sort(key=lambda item: item[0])
+        images_by_page: Dict[int, List[str]] = {}
+        for page_index, page_html, page_urls in page_results:
+            emit(page_html)
+            emit("\n")
+            if page_urls:
+                images_by_page[page_index] = page_urls
+
+        emit("</body>\n</html>")
+
+        html_content = buf.getvalue()
         
         # Salva file HTML
         html_file.write_text(html_content, encoding="utf-8")
@@ -359,79 +692,115 @@ def pdf_to_html(pdf_path: Path) -> Tuple[str, Path]:
 
 def parse_html_for_content(html_content: str, pdf_path: Path, html_dir: Path) -> Tuple[List[Tuple[str, int]], Dict[int, List[str]]]:
     """Parsea HTML e estrae testo + immagini. Ritorna (lista_paragrafi_con_pagina, immagini_per_pagina)"""
-    from bs4 import BeautifulSoup
     import base64
-    import re
-    
-    soup = BeautifulSoup(html_content, "html.parser")
-    
-    paragraphs_with_page = []
-    images_by_page = {}
-    
+
+    paragraphs_with_page: List[Tuple[str, int]] = []
+    images_by_page: Dict[int, List[str]] = {}
+
     # Estrai pagine (cercando <a name="page*"></a>)
     current_page = 1
-    current_text = []
-    image_counter = {}
-    
-    for element in soup.find_all(["a", "p", "h1", "h2", "h3", "h4", "h5", "h6", "div", "img", "pre", "span"]):
+    current_text: List[str] = []
+    image_counter: Dict[int, int] = {}
+    brand = infer_brand(pdf_path.name)
+
+    def flush_paragraph() -> None:
+        nonlocal current_text
+        if current_text:
+            text = "\n".join(current_text).strip()
+            if text:
+                paragraphs_with_page.append((text, current_page))
+            current_text = []
+
+    def set_page(anchor_name: str) -> None:
         # Rileva cambio pagina
-        if element.name == "a" and element.get("name", "").startswith("page"):
-            if current_text:
-                text = "\n".join(current_text).strip()
-                if text:
-                    paragraphs_with_page.append((text, current_page))
-                current_text = []
-            
-            try:
-                current_page = int(element.get("name", "page1").replace("page", ""))
-            except:
-                current_page += 1
-            continue
-        
+        nonlocal current_page
+        flush_paragraph()
+        try:
+            current_page = int(anchor_name.replace("page", ""))
+        except Exception:
+            current_page += 1
+
+    def handle_img(img_src: str) -> None:
         # Estrai immagini (PyMuPDF le embedded come data URI base64)
-        if element.name == "img":
-            img_src = element.get("src", "")
-            if img_src.startswith("data:image"):
-                # Decodifica data URI e salva come file
-                try:
-                    # Formato: data:image/png;base64,iVBORw0KG...
-                    match = re.match(r"data:image/(\w+);base64,(.+)", img_src)
-                    if match:
-                        img_format = match.group(1)
-                        img_data = base64.b64decode(match.group(2))
-                        
-                        brand = infer_brand(pdf_path.name)
-                        img_num = image_counter.get(current_page, 0) + 1
-                        image_counter[current_page] = img_num
-                        
-                        img_name = f"{brand}_{pdf_path.stem}_p{current_page}_{img_num}.{img_format}"
-                        img_dest = IMAGES_DIR / img_name
-                        
-                        # Salva il file
-                        img_dest.write_bytes(img_data)
-                        
-                        # Registra nell'HTML e in images_by_page
-                        img_url = f"/static/images/{img_name}"
-                        images_by_page.setdefault(current_page, []).append(img_url)
-                        
-                        # Aggiungi riferimento nel testo
-                        current_text.append(f"[IMMAGINE: {img_url}]")
-                        logger.debug("Immagine estratta: %s (pag %d)", img_name, current_page)
-                except Exception as e:
-                    logger.warning("Errore nell'estrarre immagine dalla pagina %d: %s", current_page, str(e))
-            continue
-        
+        if not img_src.startswith("data:image"):
+            return
+        # Decodifica data URI e salva come file
+        try:
+            # Formato: data:image/png;base64,iVBORw0KG...
+            # partition sul separatore letterale: niente regex e niente
+            # copia intermedia dell'intero blob base64 catturato da (.+)
+            prefix, sep, payload = img_src.partition(";base64,")
+            if sep and prefix.startswith("data:image/"):
+                img_format = prefix[len("data:image/"):]
+                img_data = base64.b64decode(payload)
+
+                img_num = image_counter.get(current_page, 0) + 1
+                image_counter[current_page] = img_num
+
+                img_name = f"{brand}_{pdf_path.stem}_p{current_page}_{img_num}.{img_format}"
+                img_dest = IMAGES_DIR / img_name
+
+                # Salva il file
+                _fast_write(img_dest, img_data)
+
+                # Registra nell'HTML e in images_by_page
+                img_url = f"/static/images/{img_name}"
+                images_by_page.setdefault(current_page, []).append(img_url)
+
+                # Aggiungi riferimento nel testo
+                current_text.append(f"[IMMAGINE: {img_url}]")
+                logger.debug("Immagine estratta: %s (pag %d)", img_name, current_page)
+        except Exception as e:
+            logger.warning("Errore nell'estrarre immagine dalla pagina %d: %s", current_page, str(e))
+
+    def handle_text(text: str) -> None:
         # Estrai testo
-        text = element.get_text(strip=True)
         if text and len(text) > 3:  # Ignora testo troppo corto
             current_text.append(text)
-    
+
+    if lxml_etree is not None:
+        # Parse in streaming: iterparse notifica la chiusura dei blocchi di
+        # primo livello (ancora, h2, div di pagina); ogni sottoalbero viene
+        # visitato in ordine di documento con la stessa logica del fallback
+        # BeautifulSoup e liberato solo dopo, così la memoria resta O(pagina)
+        # e gli span annidati sono ancora intatti quando il blocco si chiude
+        _TEXT_TAGS = {"p", "h1", "h2", "h3", "h4", "h5", "h6", "div", "pre", "span"}
+        source = io.BytesIO(html_content.encode("utf-8"))
+        for _event, elem in lxml_etree.iterparse(source, events=("end",), html=True):
+            parent = elem.getparent()
+            if parent is None or parent.tag != "body":
+                continue
+            for node in elem.iter():
+                tag = node.tag
+                if tag == "a" and (node.get("name") or "").startswith("page"):
+                    set_page(node.get("name"))
+                elif tag == "img":
+                    handle_img(node.get("src", ""))
+                elif tag in _TEXT_TAGS:
+                    # Come get_text(strip=True): frammenti strippati e
+                    # concatenati senza separatore
+                    handle_text("".join(s for s in map(str.strip, node.itertext()) if s))
+            # Sottoalbero gestito: libera l'elemento e i fratelli precedenti
+            elem.clear()
+            while elem.getprevious() is not None:
+                del parent[0]
+    else:
+        # Fallback: DOM completo con BeautifulSoup
+        from bs4 import BeautifulSoup
+
+        soup = BeautifulSoup(html_content, "html.parser")
+        for element in soup.find_all(["a", "p", "h1", "h2", "h3", "h4", "h5", "h6", "div", "img", "pre", "span"]):
+            if element.name == "a" and element.get("name", "").startswith("page"):
+                set_page(element.get("name", "page1"))
+                continue
+            if element.name == "img":
+                handle_img(element.get("src", ""))
+                continue
+            handle_text(element.get_text(strip=True))
+
     # Aggiungi ultimo paragrafo
-    if current_text:
-        text = "\n".join(current_text).strip()
-        if text:
-            paragraphs_with_page.append((text, current_page))
-    
+    flush_paragraph()
+
     logger.info("HTML parsato: %d paragrafi, %d immagini da %d pagine", 
                 len(paragraphs_with_page), sum(len(v) for v in images_by_page.values()), len(images_by_page))
     
@@ -442,11 +811,17 @@ def parse_html_for_content(html_content: str, pdf_path: Path, html_dir: Path) ->
 def generate_image_captions() -> Dict[str, str]:
     """Crea placeholder per le didascalie. L'utente edita manualmente con caption_review.bat"""
     
-    # Carica captions esistenti
-    captions = load_image_captions()
+    # Carica captions esistenti (store condiviso con flush coalescente),
+    # riallineate al file se caption_review l'ha modificato nel frattempo
+    store = _get_caption_store()
+    store.refresh()
+    captions = store.data
     logger.info("Captions esistenti caricate: %d", len(captions))
     
-    image_files = list(IMAGES_DIR.glob("*.png"))
+    if IMAGES_DIR.exists():
+        image_files = [Path(e.path) for e in os.scandir(IMAGES_DIR) if e.name.endswith(".png") and e.is_file()]
+    else:
+        image_files = []
     logger.info("Trovate %d immagini totali", len(image_files))
     
     if not image_files:
@@ -466,14 +841,14 @@ def generate_image_captions() -> Dict[str, str]:
         logger.info("Tutte le immagini hanno già una caption")
         return captions
     
-    # Assegna placeholder a tutte le immagini nuove
-    for image_path in images_to_process:
-        image_url = f"/static/images/{image_path.name}"
-        captions[image_url] = "Immagine del manuale"
-    
-    # Salva captions in JSON
-    CAPTIONS_FILE.parent.mkdir(parents=True, exist_ok=True)
-    CAPTIONS_FILE.write_text(json.dumps(captions, ensure_ascii=False, indent=2), encoding="utf-8")
+    # Assegna placeholder a tutte le immagini nuove in un solo update
+    store.update(
+        (f"/static/images/{image_path.name}", "Immagine del manuale")
+        for image_path in images_to_process
+    )
+
+    # Salva captions in JSON (un solo flush per l'intero batch)
+    store.flush()
     logger.info("Captions placeholder salvate in %s (%d immagini)", CAPTIONS_FILE, len(captions))
     print(f"\n✓ Placeholder captions salvati: {CAPTIONS_FILE}")
     print("Per personalizzare le didascalie, esegui: python -m backend.caption_review")
@@ -481,84 +856,279 @@ def generate_image_captions() -> Dict[str, str]:
     return captions
 
 
+_captions_cache: tuple[int, Dict[str, str]] | None = None
+
+
 def load_image_captions() -> Dict[str, str]:
-    """Carica le didascalie salvate delle immagini."""
-    if CAPTIONS_FILE.exists():
+    """Carica le didascalie salvate delle immagini (cache con check su mtime)."""
+    global _captions_cache
+    if not CAPTIONS_FILE.exists():
+        return {}
+    try:
+        mtime_ns = CAPTIONS_FILE.stat().st_mtime_ns
+        if _captions_cache is not None and _captions_cache[0] == mtime_ns:
+            return _captions_cache[1]
+        if orjson is not None:
+            captions = orjson.loads(CAPTIONS_FILE.read_bytes())
+        else:
+            captions = json.loads(CAPTIONS_FILE.read_text(encoding="utf-8"))
+        _captions_cache = (mtime_ns, captions)
+        return captions
+    except Exception as e:
+        logger.warning("Errore caricamento captions: %s", str(e))
+    return {}
+
+
+class _JsonStore:
+    """Dict JSON su disco con scritture coalescenti.
+
+    Le modifiche marcano il dict come dirty; il flush su disco avviene al
+    massimo ogni FLUSH_INTERVAL secondi (o su richiesta esplicita), invece
+    di riscrivere l'intero file per ogni singola voce. Un hook atexit
+    garantisce che le modifiche pendenti arrivino comunque su disco.
+    """
+
+    FLUSH_INTERVAL = 5.0  # secondi
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.data: Dict[str, str] = {}
+        self.dirty = False
+        self._last_flush = 0.0
+        # Chiavi modificate localmente e non ancora flushate; None segnala
+        # una sostituzione integrale (il contenuto locale è autoritativo)
+        self._dirty_keys: set[str] | None = set()
+        self._disk_mtime = -1
+
+    def _read_disk(self) -> Dict[str, str]:
         try:
-            return json.loads(CAPTIONS_FILE.read_text(encoding="utf-8"))
+            if orjson is not None:
+                return orjson.loads(self.path.read_bytes())
+            return json.loads(self.path.read_text(encoding="utf-8"))
         except Exception as e:
-            logger.warning("Errore caricamento captions: %s", str(e))
-    return {}
+            logger.warning("Errore caricamento %s: %s", self.path.name, str(e))
+            return {}
+
+    def refresh(self) -> None:
+        """Riallinea lo store al file se un altro processo l'ha riscritto.
+
+        Le modifiche locali non ancora flushate (chiavi in _dirty_keys, incluse
+        le cancellazioni) prevalgono sulle voci lette da disco."""
+        try:
+            mtime = self.path.stat().st_mtime_ns
+        except OSError:
+            return
+        if mtime == self._disk_mtime:
+            return
+        if self.dirty and self._dirty_keys is None:
+            # Sostituzione integrale pendente: non mergiare nulla da disco
+            return
+        disk = self._read_disk()
+        if self.dirty:
+            for key in self._dirty_keys:
+                if key in self.data:
+                    disk[key] = self.data[key]
+                else:
+                    disk.pop(key, None)
+        self.data = disk
+        self._disk_mtime = mtime
+
+    def set(self, key: str, value: str) -> None:
+        if self.data.get(key) != value:
+            self.data[key] = value
+            self.dirty = True
+            if self._dirty_keys is not None:
+                self._dirty_keys.add(key)
+
+    def update(self, items) -> None:
+        items = dict(items)
+        self.data.update(items)
+        self.dirty = True
+        if self._dirty_keys is not None:
+            self._dirty_keys.update(items)
+
+    def remove(self, key: str) -> None:
+        if key in self.data:
+            del self.data[key]
+            self.dirty = True
+            if self._dirty_keys is not None:
+                self._dirty_keys.add(key)
+
+    def replace(self, data: Dict[str, str]) -> None:
+        """Sostituisce l'intero contenuto: anche le cancellazioni persistono."""
+        self.data = dict(data)
+        self.dirty = True
+        self._dirty_keys = None
+
+    def maybe_flush(self) -> None:
+        if self.dirty and time.monotonic() - self._last_flush > self.FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self.dirty:
+            return
+        # Prima di scrivere, recupera eventuali modifiche esterne al file
+        # (es. caption_review) che altrimenti verrebbero sovrascritte
+        self.refresh()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # Scrittura su file temporaneo (unico per processo) + os.replace:
+        # più worker di ingest flushano lo stesso file e una truncate-and-
+        # write concorrente potrebbe persistere JSON troncato, che al load
+        # successivo azzererebbe silenziosamente lo store
+        tmp = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        if orjson is not None:
+            tmp.write_bytes(orjson.dumps(self.data, option=orjson.OPT_INDENT_2))
+        else:
+            tmp.write_text(json.dumps(self.data, ensure_ascii=False, indent=2), encoding="utf-8")
+        os.replace(tmp, self.path)
+        self.dirty = False
+        self._dirty_keys = set()
+        try:
+            self._disk_mtime = self.path.stat().st_mtime_ns
+        except OSError:
+            self._disk_mtime = -1
+        self._last_flush = time.monotonic()
+
+
+class _CaptionStore(_JsonStore):
+    def __init__(self) -> None:
+        super().__init__(CAPTIONS_FILE)
+
+    def flush(self) -> None:
+        global _captions_cache
+        if not self.dirty:
+            return
+        super().flush()
+        _captions_cache = None
+
+
+_caption_store: _CaptionStore | None = None
+
+
+def _get_caption_store() -> _CaptionStore:
+    global _caption_store
+    if _caption_store is None:
+        store = _CaptionStore()
+        store.refresh()
+        atexit.register(store.flush)
+        _caption_store = store
+    return _caption_store
 
 
 def save_captions(captions: Dict[str, str]) -> None:
-    CAPTIONS_FILE.parent.mkdir(parents=True, exist_ok=True)
-    CAPTIONS_FILE.write_text(json.dumps(captions, ensure_ascii=False, indent=2), encoding="utf-8")
+    """Flush esplicito: sostituisce il contenuto dello store e scrive subito.
 
+    Semantica di replace, non di merge: chi passa un dict da cui ha tolto
+    delle voci (es. cleanup_small_images) deve vederle sparire dal file."""
+    store = _get_caption_store()
+    store.replace(captions)
+    store.flush()
+
+
+_image_hash_store: _JsonStore | None = None
+
+
+def _get_image_hash_store() -> _JsonStore:
+    """Indice content-hash -> URL delle immagini già scritte su disco."""
+    global _image_hash_store
+    if _image_hash_store is None:
+        store = _JsonStore(IMG_HASHES_FILE)
+        store.refresh()
+        atexit.register(store.flush)
+        _image_hash_store = store
+    return _image_hash_store
+
+
+def _purge_image_hashes(removed_urls: set[str]) -> None:
+    """Elimina dall'indice hash le voci che puntano a file rimossi.
+
+    Senza questa pulizia un hash hit riuserebbe l'URL di un'immagine che
+    non esiste più su disco, producendo link rotti al reingest successivo."""
+    if not removed_urls:
+        return
+    store = _get_image_hash_store()
+    stale = [digest for digest, url in store.data.items() if url in removed_urls]
+    if stale:
+        for digest in stale:
+            store.remove(digest)
+        store.flush()
+
+
+def extract_pdf(pdf_path: Path) -> Tuple[Dict[int, List[str]], List[str]]:
+    """Estrae immagini di pagina e testo strutturato in un solo passaggio.
+
+    Apre il documento una volta sola con PyMuPDF: ogni pagina viene resa a
+    150 DPI (stesso output di extract_images) e il testo letto a blocchi,
+    senza riparsare il PDF due volte.
+    """
+    import fitz
 
-def extract_images(pdf_path: Path) -> Dict[int, List[str]]:
-    """Estrae immagini dal PDF usando pdf2image (cattura anche vettoriali)."""
-    from pdf2image import convert_from_path
-    from PIL import Image
-    
     IMAGES_DIR.mkdir(parents=True, exist_ok=True)
     page_images: Dict[int, List[str]] = {}
-    
-    logger.info("=== Analisi PDF: %s ===", pdf_path.name)
-    
-    try:
-        # Converti ogni pagina in immagine
-        images = convert_from_path(pdf_path, dpi=150)  # 150 DPI è buon compromesso qualità/dimensione
-        logger.info("Totale pagine: %d", len(images))
-        
-        brand = infer_brand(pdf_path.name)
-        
-        for page_index, image in enumerate(images, start=1):
-            # Salva ogni pagina come immagine
+    pages_text: List[str] = []
+    brand = infer_brand(pdf_path.name)
+    matrix = fitz.Matrix(150 / 72, 150 / 72)  # 150 DPI come extract_images
+    # Una sola scandir invece di uno stat() per immagine
+    existing = {p.name for p in IMAGES_DIR.iterdir()}
+
+    with open_pdf(pdf_path) as doc:
+        logger.info("=== Analisi PDF: %s (%d pagine, passaggio unico) ===", pdf_path.name, doc.page_count)
+        for page_num in range(doc.page_count):
+            page = doc.load_page(page_num)
+            page_index = page_num + 1
+
+            # Immagine della pagina
             file_name = f"{brand}_{pdf_path.stem}_p{page_index}.png"
             image_path = IMAGES_DIR / file_name
-            
-            if image_path.exists():
+            relative = f"/static/images/{file_name}"
+            if file_name in existing:
                 logger.debug("Immagine già estratta: %s", file_name)
-                relative = f"/static/images/{file_name}"
-                page_images.setdefault(page_index, []).append(relative)
-                continue
-            
-            try:
-                image.save(image_path, "PNG")
-                width, height = image.size
-                logger.info("Pagina %d: estratta immagine %dx%d", page_index, width, height)
-                
-                relative = f"/static/images/{file_name}"
                 page_images.setdefault(page_index, []).append(relative)
-            except Exception as e:
-                logger.error("Errore nel salvare pagina %d: %s", page_index, str(e))
-                continue
-    
-    except Exception as e:
-        logger.error("Errore nell'estrazione delle immagini da %s: %s", pdf_path.name, str(e))
-        return page_images
-    
-    total_extracted = sum(len(v) for v in page_images.values())
-    logger.info("PDF %s: estratte %d immagini totali (1 per pagina)", pdf_path.name, total_extracted)
-    return page_images
+            else:
+                try:
+                    pix = page.get_pixmap(matrix=matrix, alpha=False)
+                    pix.save(str(image_path))
+                    existing.add(file_name)
+                    page_images.setdefault(page_index, []).append(relative)
+                except Exception as e:
+                    logger.error("Errore nel salvare pagina %d: %s", page_index, str(e))
+
+            # Testo a blocchi della stessa pagina
+            page_content: List[str] = []
+            for block in page.get_text("blocks"):
+                if block[6] == 0:  # tipo 0 = blocco di testo
+                    text = block[4].strip()
+                    if text:
+                        page_content.append(text)
+            pages_text.append("\n".join(page_content))
+
+    return page_images, pages_text
 
 
 def cleanup_small_images(min_width: int = 80, min_height: int = 80, min_area: int = 8000) -> int:
-    import fitz
-    
     if not IMAGES_DIR.exists():
         return 0
 
     captions = load_image_captions()
     removed = 0
+    removed_urls: set[str] = set()
 
-    for image_path in IMAGES_DIR.glob("*.png"):
+    # os.scandir: un solo syscall-walk della directory, niente oggetti Path
+    # e stat ripetuti come con glob
+    for entry in os.scandir(IMAGES_DIR):
+        if not entry.name.endswith(".png") or not entry.is_file():
+            continue
+        image_path = Path(entry.path)
         try:
-            pix = fitz.Pixmap(str(image_path))
-            width = pix.width
-            height = pix.height
-            pix = None
+            # Le dimensioni PNG stanno nell'IHDR nei primi 24 byte:
+            # inutile decodificare i pixel per leggere due interi
+            with open(entry.path, "rb") as f:
+                head = f.read(24)
+            if len(head) >= 24 and head[:8] == b"\x89PNG\r\n\x1a\n":
+                width, height = struct.unpack(">II", head[16:24])
+            else:
+                width = 0
+                height = 0
         except Exception:
             width = 0
             height = 0
@@ -571,30 +1141,20 @@ def cleanup_small_images(min_width: int = 80, min_height: int = 80, min_area: in
                 pass
 
             image_url = f"/static/images/{image_path.name}"
+            removed_urls.add(image_url)
             if image_url in captions:
                 captions.pop(image_url, None)
 
     if removed:
         save_captions(captions)
+        _purge_image_hashes(removed_urls)
 
     return removed
 
 
-def build_html(pdf_path: Path, chunks_by_page: Dict[int, List[Chunk]], images_by_page: Dict[int, List[str]]) -> str:
-    HTML_DIR.mkdir(parents=True, exist_ok=True)
-    html_path = HTML_DIR / f"{pdf_path.stem}.html"
-    
-    # Carica le captions delle immagini
-    captions = load_image_captions()
-
-    parts = [
-        "<!doctype html>",
-        "<html>",
-        "<head>",
-        '<meta charset="utf-8"/>',
-        '<meta name="viewport" content="width=device-width, initial-scale=1.0"/>',
-        f"<title>{html.escape(pdf_path.stem)}</title>",
-        """<style>
+# Foglio di stile condiviso da tutti gli HTML generati: costruito una
+# volta a import-time invece che a ogni chiamata di build_html
+_STYLE = """<style>
             * { margin: 0; padding: 0; box-sizing: border-box; }
             body {
                 font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
@@ -766,48 +1326,88 @@ def build_html(pdf_path: Path, chunks_by_page: Dict[int, List[Chunk]], images_by
                 line-height: 1.5;
                 border-top: 1px solid #e0e0e0;
             }
-        </style>""",
+        </style>"""
+
+
+def build_html(pdf_path: Path, chunks_by_page: Dict[int, List[Chunk]], images_by_page: "Dict[int, List[str]] | ImageIndex") -> str:
+    HTML_DIR.mkdir(parents=True, exist_ok=True)
+    html_path = HTML_DIR / f"{pdf_path.stem}.html"
+    
+    # Carica le captions delle immagini, già escapate una volta sola
+    captions = load_image_captions()
+    esc_captions = {url: html.escape(caption) for url, caption in captions.items()}
+    default_caption = html.escape("Immagine del manuale")
+    esc_title = html.escape(pdf_path.stem)
+
+    # Path relativo e didascalia calcolati una volta per immagine: loghi e
+    # intestazioni ricorrono su molte pagine e ripetere Path()/get() per
+    # occorrenza sarebbe lavoro sprecato
+    img_meta = {
+        url: (f"../images/{Path(url).name}", esc_captions.get(url, default_caption))
+        for urls in images_by_page.values()
+        for url in urls
+    }
+
+    # Scrive direttamente in uno StringIO: evita una lista con decine di
+    # migliaia di frammenti e la join finale su tutto il documento
+    buf = io.StringIO()
+
+    def emit(fragment: str) -> None:
+        buf.write(fragment)
+        buf.write("\n")
+
+    for fragment in (
+        "<!doctype html>",
+        "<html>",
+        "<head>",
+        '<meta charset="utf-8"/>',
+        '<meta name="viewport" content="width=device-width, initial-scale=1.0"/>',
+        f"<title>{esc_title}</title>",
+        _STYLE,
         "</head>",
         "<body>",
         '<div class="container">',
         "<header>",
-        f"<h1>📄 {html.escape(pdf_path.stem)}</h1>",
+        f"<h1>📄 {esc_title}</h1>",
         f"<p style='opacity:0.9; margin-top:10px;'>{len(chunks_by_page)} pagine</p>",
         "</header>",
         '<div class="toc">',
         '<h3>📑 Indice</h3>',
         '<ul>',
-    ]
+    ):
+        emit(fragment)
 
     # Genera indice
     for idx in sorted(chunks_by_page.keys()):
-        parts.append(f'<li><a href="#page-{idx}">Pagina {idx}</a></li>')
+        emit(f'<li><a href="#page-{idx}">Pagina {idx}</a></li>')
     
-    parts.append('</ul>')
-    parts.append('</div>')
+    emit('</ul>')
+    emit('</div>')
 
     # Genera pagine con chunk
     for page_num in sorted(chunks_by_page.keys()):
         page_chunks = chunks_by_page[page_num]
-        parts.append(f'<div class="page" id="page-{page_num}">')
-        parts.append(f'<div class="page-indicator">Pag. {page_num}</div>')
-        parts.append('<div class="page-header">')
-        parts.append(f'<span class="page-number">Pag. {page_num}</span>')
-        parts.append(f'<h2>Pagina {page_num}</h2>')
-        parts.append('</div>')
+        emit(f'<div class="page" id="page-{page_num}">')
+        emit(f'<div class="page-indicator">Pag. {page_num}</div>')
+        emit('<div class="page-header">')
+        emit(f'<span class="page-number">Pag. {page_num}</span>')
+        emit(f'<h2>Pagina {page_num}</h2>')
+        emit('</div>')
         
         # Mostra ogni chunk
         for idx, chunk in enumerate(page_chunks, 1):
-            parts.append(f'<div class="chunk" id="chunk-{chunk.id}">')
-            parts.append(f'<div class="chunk-header">CHUNK {idx}/{len(page_chunks)}</div>')
+            emit(f'<div class="chunk" id="chunk-{chunk.id}">')
+            emit(f'<div class="chunk-header">CHUNK {idx}/{len(page_chunks)}</div>')
             
             # Rimuovi le note sulle immagini dal testo per l'HTML
             chunk_text = chunk.text
             if "[Immagini disponibili in questa pagina:" in chunk_text:
                 chunk_text = chunk_text.split("[Immagini disponibili in questa pagina:")[0].strip()
             
-            # Formatta il testo e gli elenchi puntati
-            lines = [ln.strip() for ln in chunk_text.split('\n') if ln.strip()]
+            # Formatta il testo e gli elenchi puntati: un'unica passata
+            # regex sull'intero chunk, niente split/strip riga per riga.
+            # html.escape in locale: un LOAD_ATTR in meno per riga
+            esc = html.escape
             html_parts = []
             list_items = []
 
@@ -819,161 +1419,276 @@ def build_html(pdf_path: Path, chunks_by_page: Dict[int, List[Chunk]], images_by
                     html_parts.append("</ul>")
                     list_items = []
 
-            for line in lines:
+            for m in _CHUNK_LINE_RE.finditer(chunk_text):
+                line = m.group("line")
+                if not line:
+                    continue
+
                 # Titoli numerati
-                if re.match(r'^\d+\.(\d+\.)*\s', line):
+                if m.group("heading"):
                     flush_list()
                     level = line.split()[0].count('.')
                     css_class = "heading-1" if level <= 1 else "heading-2"
-                    safe_line = html.escape(line)
+                    safe_line = esc(line)
                     html_parts.append(f'<div class="{css_class}">{safe_line}</div>')
                     continue
 
-                # Elenchi puntati
-                if re.match(r'^[-•*]\s+', line):
-                    item_text = re.sub(r'^[-•*]\s+', '', line)
-                    list_items.append(f"<li>{html.escape(item_text)}</li>")
+                # Elenchi puntati: il testo è già catturato dal gruppo rest
+                if m.group("bullet"):
+                    list_items.append(f"<li>{esc(m.group('rest'))}</li>")
                     continue
 
                 flush_list()
-                html_parts.append(f"<p>{html.escape(line)}</p>")
+                html_parts.append(f"<p>{esc(line)}</p>")
 
             flush_list()
 
-            formatted_text = "\n".join(html_parts) if html_parts else f"<p>{html.escape(chunk_text)}</p>"
-            parts.append(f"<div class=\"chunk-text\">{formatted_text}</div>")
-            parts.append('</div>')  # chiudi chunk
+            # Un'unica join per chunk, scritta direttamente nel buffer senza
+            # ricopiarla in un f-string intermedio
+            buf.write('<div class="chunk-text">')
+            if html_parts:
+                buf.write("\n".join(html_parts))
+            else:
+                buf.write(f"<p>{esc(chunk_text)}</p>")
+            buf.write("</div>\n")
+            emit('</div>')  # chiudi chunk
         
         # Aggiungi immagini della pagina
         if page_num in images_by_page and images_by_page[page_num]:
-            parts.append('<div class="images-grid">')
+            emit('<div class="images-grid">')
             for img_url in images_by_page[page_num]:
-                img_relative = f"../images/{Path(img_url).name}"
-                caption = captions.get(img_url, "Immagine del manuale")
-                parts.append('<div class="image-item">')
-                parts.append(f'<img src="{img_relative}" alt="{html.escape(caption)}" loading="lazy"/>')
-                parts.append(f'<div class="image-caption">{html.escape(caption)}</div>')
-                parts.append('</div>')
-            parts.append('</div>')
+                img_relative, caption = img_meta[img_url]
+                emit('<div class="image-item">')
+                emit(f'<img src="{img_relative}" alt="{caption}" loading="lazy"/>')
+                emit(f'<div class="image-caption">{caption}</div>')
+                emit('</div>')
+            emit('</div>')
         
-        parts.append("</div>")  # chiudi page
+        emit("</div>")  # chiudi page
 
-    parts.append("</div>")
-    parts.append("</body>")
-    parts.append("</html>")
+    emit("</div>")
+    emit("</body>")
+    emit("</html>")
 
-    html_path.write_text("\n".join(parts), encoding="utf-8")
+    html_path.write_text(buf.getvalue(), encoding="utf-8")
     return f"/static/html/{html_path.name}"
 
 
-def extract_text_with_structure(pdf_path: Path) -> List[str]:
-    """Estrae testo preservando struttura (titoli, paragrafi) usando pymupdf."""
-    doc = fitz.open(pdf_path)
-    pages_text: List[str] = []
-    
-    for page_index in range(doc.page_count):
-        page = doc.load_page(page_index)
-        blocks = page.get_text("blocks")
-        
-        page_content: List[str] = []
-        for block in blocks:
-            if block[6] == 0:  # tipo 0 = blocco di testo
-                text = block[4].strip()
-                if text:
-                    page_content.append(text)
-        
-        pages_text.append("\n".join(page_content))
-    
-    doc.close()
-    return pages_text
+# Sotto questa soglia i thread costano piu di quel che rendono
+_PARALLEL_EXTRACT_MIN_PAGES = 20
 
 
-def _ingest_pdf_legacy(pdf_path: Path, brand: str, images_by_page: Dict[int, List[str]], captions: Dict[str, str]) -> Tuple[List[Chunk], int]:
-    """Fallback per estrazione diretta da PDF quando HTML parsing fallisce"""
-    chunks: List[Chunk] = []
-    pages_text = extract_text_with_structure(pdf_path)
-    logger.info("Fallback: Estratto testo da %s pagine con struttura diretta", len(pages_text))
+def extract_text_with_structure(pdf_path: Path) -> Iterator[str]:
+    """Estrae testo preservando struttura (titoli, paragrafi) usando pymupdf.
 
-    for page_index, text in enumerate(pages_text, start=1):
-        logger.info("Chunking pagina %d (fallback) - testo: %d char", page_index, len(text))
-        
-        # Estrai i paragrafi mantenendo la struttura
-        title_pattern = re.compile(r"^\d+(?:\.\d+)*\.?\s+.+")
-        lines = [line.strip() for line in text.splitlines() if line.strip()]
-        
-        paragraphs: List[str] = []
-        current: List[str] = []
-        pending_title = ""
-
-        for line in lines:
-            if title_pattern.match(line):
-                if current:
-                    paragraph_text = " ".join(current).strip()
-                    if pending_title:
-                        paragraph_text = f"{pending_title}\n{paragraph_text}"
-                        pending_title = ""
-                    paragraphs.append(paragraph_text)
-                    current = []
-                pending_title = line
-                continue
+    Generatore: yielda una pagina alla volta, così il documento non resta
+    mai interamente in memoria. Sui documenti lunghi le pagine vengono
+    estratte in parallelo su thread (PyMuPDF rilascia il GIL nel C),
+    ricomposte in ordine di pagina."""
+    import fitz
 
-            if pending_title and not current and not title_pattern.match(line):
-                if len(line) <= 60 or (line and line[0].islower()):
-                    pending_title = f"{pending_title} {line}".strip()
-                    continue
+    with open_pdf(pdf_path) as doc:
+        page_count = doc.page_count
+        if page_count <= _PARALLEL_EXTRACT_MIN_PAGES:
+            for page_index in range(page_count):
+                page = doc.load_page(page_index)
+                # get_text("text") restituisce solo i blocchi di testo senza
+                # materializzare la 7-tupla per blocco di get_text("blocks")
+                yield page.get_text("text").strip()
+            return
+
+    # Un handle per thread: condividere lo stesso Document tra thread non è
+    # sicuro in PyMuPDF, ma aperture indipendenti dello stesso file sì
+    local = threading.local()
+    handles: List = []
+
+    def _page_text(page_index: int) -> str:
+        thread_doc = getattr(local, "doc", None)
+        if thread_doc is None:
+            thread_doc = local.doc = fitz.open(pdf_path)
+            handles.append(thread_doc)
+        return thread_doc.load_page(page_index).get_text("text").strip()
 
-            current.append(line)
+    try:
+        with ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1)) as pool:
+            yield from pool.map(_page_text, range(page_count))
+    finally:
+        for handle in handles:
+            handle.close()
+
+
+def _chunk_paragraph_fixed(text: str, size: int = 1000) -> List[str]:
+    """Fast-path di chunk_text specializzato per (size fisso, overlap=0).
+
+    I paragrafi in ingresso sono già passati dallo splitter dei titoli di
+    _build_page_chunks, quindi basta affettare a finestre consecutive con
+    backoff all'ultimo spazio per non troncare le parole: niente aritmetica
+    di overlap né raggruppamento di paragrafi della versione generale."""
+    stripped = text.strip()
+    if len(stripped) <= size:
+        return [stripped] if stripped else []
+
+    pieces: List[str] = []
+    i = 0
+    n = len(stripped)
+    while i < n:
+        end = i + size
+        if end < n:
+            # Arretra fino a uno spazio, se ce n'è uno nella finestra
+            cut = stripped.rfind(" ", i + 1, end)
+            if cut > i:
+                end = cut
+        piece = stripped[i:end].strip()
+        if piece:
+            pieces.append(piece)
+        i = end
+    return pieces
+
+
+def _uuid4_batch(n: int) -> List[str]:
+    """Genera n UUID4 da una sola lettura di os.urandom.
+
+    str(uuid.uuid4()) fa una syscall da 16 byte per id; qui i byte vengono
+    letti in blocco e poi marchiati versione/variante come da RFC 4122."""
+    if n <= 0:
+        return []
+    buf = bytearray(os.urandom(16 * n))
+    ids: List[str] = []
+    for i in range(0, 16 * n, 16):
+        buf[i + 6] = (buf[i + 6] & 0x0F) | 0x40  # versione 4
+        buf[i + 8] = (buf[i + 8] & 0x3F) | 0x80  # variante RFC 4122
+        ids.append(str(uuid.UUID(bytes=bytes(buf[i:i + 16]))))
+    return ids
+
+
+def _build_page_chunks(page_index: int, text: str, page_images: List[str], captions: Dict[str, str], brand: str, manual: str) -> List[Chunk]:
+    """Segmenta il testo di una pagina e costruisce i suoi Chunk.
+
+    Corpo del loop per-pagina di ingest_pdf/_ingest_pdf_legacy, estratto in
+    funzione così le pagine (indipendenti) possono girare in parallelo su un
+    thread pool."""
+    # Estrai i paragrafi mantenendo la struttura
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
 
-        if current:
-            paragraph_text = " ".join(current).strip()
-            if pending_title:
-                paragraph_text = f"{pending_title}\n{paragraph_text}"
-                pending_title = ""
-            paragraphs.append(paragraph_text)
-        elif pending_title:
-            paragraphs.append(pending_title)
+    paragraphs: List[str] = []
+    current: List[str] = []
+    pending_title = ""
 
-        # Per ogni paragrafo, crea la versione con immagini embedded
-        for paragraph in paragraphs:
-            if not paragraph.strip():
+    for line in lines:
+        # Le righe sono gia strippate dalla comprehension sopra: il join non
+        # ha bisogno di un ulteriore strip, e il match del titolo va fatto
+        # una volta sola per riga
+        if _TITLE_RE.match(line):
+            if current:
+                paragraph_text = " ".join(current)
+                if pending_title:
+                    paragraph_text = f"{pending_title}\n{paragraph_text}"
+                    pending_title = ""
+                paragraphs.append(paragraph_text)
+                current = []
+            pending_title = line
+            continue
+
+        if pending_title and not current:
+            if len(line) <= 60 or line[:1].islower():
+                pending_title = f"{pending_title} {line}"
                 continue
 
-            # Crea una versione del paragrafo con le immagini incorporate
-            full_paragraph_with_images = paragraph
-            page_images = images_by_page.get(page_index, [])
-            if page_images:
-                # Aggiungi le immagini alla fine del paragrafo con le loro didascalie
-                image_blocks = []
-                for img_url in page_images:
-                    caption = captions.get(img_url, "Immagine illustrativa")
-                    image_blocks.append(f"[IMMAGINE: {img_url} - {caption}]")
-                full_paragraph_with_images = f"{paragraph}\n\n" + "\n".join(image_blocks)
-
-            # Ora chunka il paragrafo se è troppo lungo
-            pieces = chunk_text(paragraph, size=1000, overlap=0)
-            if not pieces:
-                pieces = [paragraph]
-
-            # Per ogni chunk del paragrafo, crea un Chunk con il full_paragraph completo
-            for piece in pieces:
-                chunk_id = str(uuid.uuid4())
-                html_file = ""
-                html_anchor = f"chunk-{chunk_id}"
-                chunk = Chunk(
-                    id=chunk_id,
-                    brand=brand,
-                    manual=pdf_path.stem,
-                    page=page_index,
-                    text=piece,  # Il chunk segmentato per la ricerca
-                    images=page_images,
-                    html_file=html_file,
-                    html_anchor=html_anchor,
-                    full_paragraph=full_paragraph_with_images,  # Paragrafo completo con immagini per l'LLM
-                )
-                chunks.append(chunk)
-        
-        if page_index % 5 == 0 or page_index == 1:
-            logger.info("Elaborata pagina %d/%d (fallback) - %d chunk creati", page_index, len(pages_text), len(chunks))
+        current.append(line)
+
+    if current:
+        paragraph_text = " ".join(current)
+        if pending_title:
+            paragraph_text = f"{pending_title}\n{paragraph_text}"
+            pending_title = ""
+        paragraphs.append(paragraph_text)
+    elif pending_title:
+        paragraphs.append(pending_title)
+
+    # Il blocco immagini è identico per tutti i paragrafi della pagina:
+    # costruiscilo una volta sola invece che per paragrafo
+    page_image_suffix = ""
+    if page_images:
+        cap_get = captions.get
+        page_image_suffix = "\n\n" + "\n".join(
+            f"[IMMAGINE: {img_url} - {cap_get(img_url, 'Immagine illustrativa')}]"
+            for img_url in page_images
+        )
+
+    # Per ogni paragrafo, crea la versione con immagini embedded
+    pieces_by_paragraph: List[Tuple[List[str], str]] = []
+    for paragraph in paragraphs:
+        if not paragraph.strip():
+            continue
+
+        # Crea una versione del paragrafo con le immagini incorporate
+        full_paragraph_with_images = paragraph + page_image_suffix
+
+        # Ora chunka il paragrafo se è troppo lungo
+        pieces = _chunk_paragraph_fixed(paragraph, size=1000)
+        if not pieces:
+            pieces = [paragraph]
+        pieces_by_paragraph.append((pieces, full_paragraph_with_images))
+
+    # Tutti gli id della pagina da un'unica lettura di os.urandom invece di
+    # una syscall per chunk
+    ids = iter(_uuid4_batch(sum(len(pieces) for pieces, _ in pieces_by_paragraph)))
+
+    page_chunks: List[Chunk] = []
+    for pieces, full_paragraph_with_images in pieces_by_paragraph:
+        # Per ogni chunk del paragrafo, crea un Chunk con il full_paragraph completo
+        for piece in pieces:
+            chunk_id = next(ids)
+            page_chunks.append(Chunk(
+                id=chunk_id,
+                brand=brand,
+                manual=manual,
+                page=page_index,
+                text=piece,  # Il chunk segmentato per la ricerca
+                images=page_images,
+                html_file="",
+                html_anchor=f"chunk-{chunk_id}",
+                full_paragraph=full_paragraph_with_images,  # Paragrafo completo con immagini per l'LLM
+            ))
+
+    return page_chunks
+
+
+def _chunk_pages_parallel(pages: List[Tuple[int, str]], images_by_page, captions: Dict[str, str], brand: str, manual: str) -> List[Chunk]:
+    """Esegue _build_page_chunks su tutte le pagine, in parallelo se conviene.
+
+    I risultati vengono ricomposti in ordine di pagina, così l'indice resta
+    deterministico qualunque sia l'ordine di completamento dei thread."""
+    max_workers = min(8, os.cpu_count() or 1)
+    chunks: List[Chunk] = []
+
+    if len(pages) > 1 and max_workers > 1:
+        results: Dict[int, List[Chunk]] = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = {
+                pool.submit(_build_page_chunks, page_index, text, images_by_page.get(page_index, []), captions, brand, manual): page_index
+                for page_index, text in pages
+            }
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+        for page_index in sorted(results):
+            chunks.extend(results[page_index])
+    else:
+        for page_index, text in pages:
+            chunks.extend(_build_page_chunks(page_index, text, images_by_page.get(page_index, []), captions, brand, manual))
+
+    return chunks
+
+
+def _ingest_pdf_legacy(pdf_path: Path, brand: str, images_by_page: "Dict[int, List[str]] | ImageIndex", captions: Dict[str, str], pages_text: Iterable[str] = None) -> Tuple[List[Chunk], int]:
+    """Fallback per estrazione diretta da PDF quando HTML parsing fallisce"""
+    if pages_text is None:
+        pages_text = extract_text_with_structure(pdf_path)
+    logger.info("Fallback: estrazione testo con struttura diretta da %s", pdf_path.name)
+
+    pages = list(enumerate(pages_text, start=1))
+    chunks = _chunk_pages_parallel(pages, images_by_page, captions, brand, pdf_path.stem)
+    logger.info("Elaborate %d pagine (fallback) - %d chunk creati", len(pages), len(chunks))
 
     # Raggruppa chunk per pagina per l'HTML
     chunks_by_page: Dict[int, List[Chunk]] = {}
@@ -996,12 +1711,15 @@ def ingest_pdf(pdf_path: Path) -> Tuple[List[Chunk], int]:
     # Step 1: Converti PDF a HTML ED estrai immagini
     try:
         html_content, html_file, images_by_page = pdf_to_html_with_images(pdf_path)
+        # Impacchetta l'indice pagina->immagini in formato SoA: da qui in
+        # poi è di sola lettura e il dict di liste non serve più
+        images_by_page = ImageIndex.from_dict(images_by_page)
     except Exception as e:
         logger.error("Fallito il parsing HTML per %s: %s. Fallback a estrazione diretta.", pdf_path.name, str(e))
-        # Fallback: usa il vecchio metodo
-        images_by_page = extract_images(pdf_path)
+        # Fallback: immagini e testo in un solo passaggio sul documento
+        images_by_page, pages_text = extract_pdf(pdf_path)
         captions = load_image_captions()
-        return _ingest_pdf_legacy(pdf_path, brand, images_by_page, captions)
+        return _ingest_pdf_legacy(pdf_path, brand, ImageIndex.from_dict(images_by_page), captions, pages_text)
     
     # Step 2: Parsea HTML per estrarre testo
     try:
@@ -1026,95 +1744,16 @@ def ingest_pdf(pdf_path: Path) -> Tuple[List[Chunk], int]:
         
     except Exception as e:
         logger.error("Errore nel parsing HTML: %s. Fallback a estrazione diretta.", str(e))
-        images_by_page = extract_images(pdf_path)
+        images_by_page, pages_text = extract_pdf(pdf_path)
         captions = load_image_captions()
-        return _ingest_pdf_legacy(pdf_path, brand, images_by_page, captions)
+        return _ingest_pdf_legacy(pdf_path, brand, ImageIndex.from_dict(images_by_page), captions, pages_text)
 
     # Continua con il nuovo flusso HTML
     captions = load_image_captions()
 
-    chunks: List[Chunk] = []
-    
-    for page_index, text in pages_text_str.items():
-        logger.info("Chunking pagina %d - testo: %d char", page_index, len(text))
-        
-        # Estrai i paragrafi mantenendo la struttura
-        title_pattern = re.compile(r"^\d+(?:\.\d+)*\.?\s+.+")
-        lines = [line.strip() for line in text.splitlines() if line.strip()]
-        
-        paragraphs: List[str] = []
-        current: List[str] = []
-        pending_title = ""
-
-        for line in lines:
-            if title_pattern.match(line):
-                if current:
-                    paragraph_text = " ".join(current).strip()
-                    if pending_title:
-                        paragraph_text = f"{pending_title}\n{paragraph_text}"
-                        pending_title = ""
-                    paragraphs.append(paragraph_text)
-                    current = []
-                pending_title = line
-                continue
-
-            if pending_title and not current and not title_pattern.match(line):
-                if len(line) <= 60 or (line and line[0].islower()):
-                    pending_title = f"{pending_title} {line}".strip()
-                    continue
-
-            current.append(line)
-
-        if current:
-            paragraph_text = " ".join(current).strip()
-            if pending_title:
-                paragraph_text = f"{pending_title}\n{paragraph_text}"
-                pending_title = ""
-            paragraphs.append(paragraph_text)
-        elif pending_title:
-            paragraphs.append(pending_title)
-
-        # Per ogni paragrafo, crea la versione con immagini embedded
-        for paragraph in paragraphs:
-            if not paragraph.strip():
-                continue
-
-            # Crea una versione del paragrafo con le immagini incorporate
-            full_paragraph_with_images = paragraph
-            page_images = images_by_page.get(page_index, [])
-            if page_images:
-                # Aggiungi le immagini alla fine del paragrafo con le loro didascalie
-                image_blocks = []
-                for img_url in page_images:
-                    caption = captions.get(img_url, "Immagine illustrativa")
-                    image_blocks.append(f"[IMMAGINE: {img_url} - {caption}]")
-                full_paragraph_with_images = f"{paragraph}\n\n" + "\n".join(image_blocks)
-
-            # Ora chunka il paragrafo se è troppo lungo
-            pieces = chunk_text(paragraph, size=1000, overlap=0)
-            if not pieces:
-                pieces = [paragraph]
-
-            # Per ogni chunk del paragrafo, crea un Chunk con il full_paragraph completo
-            for piece in pieces:
-                chunk_id = str(uuid.uuid4())
-                html_file = ""
-                html_anchor = f"chunk-{chunk_id}"
-                chunk = Chunk(
-                    id=chunk_id,
-                    brand=brand,
-                    manual=pdf_path.stem,
-                    page=page_index,
-                    text=piece,  # Il chunk segmentato per la ricerca
-                    images=page_images,
-                    html_file=html_file,
-                    html_anchor=html_anchor,
-                    full_paragraph=full_paragraph_with_images,  # Paragrafo completo con immagini per l'LLM
-                )
-                chunks.append(chunk)
-        
-        if page_index % 5 == 0 or page_index == 1:
-            logger.info("Elaborata pagina %d/%d - %d chunk creati", page_index, len(pages_text), len(chunks))
+    pages = sorted(pages_text_str.items())
+    chunks = _chunk_pages_parallel(pages, images_by_page, captions, brand, pdf_path.stem)
+    logger.info("Elaborate %d pagine - %d chunk creati", len(pages), len(chunks))
 
     # Raggruppa chunk per pagina per l'HTML
     chunks_by_page: Dict[int, List[Chunk]] = {}
@@ -1136,14 +1775,34 @@ def ingest_all() -> IngestResult:
         logger.warning("Nessun PDF trovato in manuals/ o root")
         return IngestResult(manuals=0, chunks=0, images=0)
 
-    all_chunks: List[Chunk] = []
+    total_chunks = 0
     total_images = 0
 
-    # Prima estrai le immagini dai PDF
-    for pdf in pdfs:
-        chunks, img_count = ingest_pdf(pdf)
-        all_chunks.extend(chunks)
-        total_images += img_count
+    # Azzera l'indice, poi appendi i chunk di ogni PDF appena pronti:
+    # la RSS resta O(un manuale) invece di O(intero corpus)
+    save_index([])
+
+    # Prima estrai le immagini dai PDF, in parallelo: ogni manuale è
+    # indipendente e PyMuPDF è CPU-bound, quindi un processo per PDF.
+    # Scalda la cache delle captions nel padre prima di avviare i worker
+    load_image_captions()
+    max_workers = min(len(pdfs), os.cpu_count() or 1, 6)
+    if max_workers > 1:
+        from concurrent.futures import ProcessPoolExecutor, as_completed
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(ingest_pdf, pdf): pdf for pdf in pdfs}
+            for done, future in enumerate(as_completed(futures), start=1):
+                chunks, img_count = future.result()
+                add_to_index(chunks)
+                total_chunks += len(chunks)
+                total_images += img_count
+                logger.info("Completato %s (%d/%d)", futures[future].name, done, len(pdfs))
+    else:
+        for pdf in pdfs:
+            chunks, img_count = ingest_pdf(pdf)
+            add_to_index(chunks)
+            total_chunks += len(chunks)
+            total_images += img_count
 
     # Rimuovi immagini troppo piccole e pulisci le captions
     # (Disabilitato: vogliamo tutte le immagini)
@@ -1159,16 +1818,14 @@ def ingest_all() -> IngestResult:
     captions = load_image_captions()
     logger.info("Captions caricati: %d immagini", len(captions))
 
-    logger.info("Salvataggio indice con %s chunk", len(all_chunks))
-    save_index(all_chunks)
-    logger.info("Indice salvato completamente")
+    logger.info("Indice salvato completamente (%d chunk)", total_chunks)
     logger.info(
         "Ingestione completata: manuali=%s, chunk=%s, immagini=%s",
         len(pdfs),
-        len(all_chunks),
+        total_chunks,
         total_images,
     )
-    return IngestResult(manuals=len(pdfs), chunks=len(all_chunks), images=total_images)
+    return IngestResult(manuals=len(pdfs), chunks=total_chunks, images=total_images)
 
 
 def main() -> None:
@@ -1188,6 +1845,14 @@ def main() -> None:
         if images_path.exists():
             shutil.rmtree(images_path)
             logger.info("Immagini eliminate")
+        # L'indice hash -> URL deve seguire le immagini: voci sopravvissute
+        # farebbero saltare la riscrittura dei file al prossimo ingest
+        if IMG_HASHES_FILE.exists():
+            IMG_HASHES_FILE.unlink()
+            logger.info("Indice hash immagini eliminato")
+        if _image_hash_store is not None:
+            _image_hash_store.data.clear()
+            _image_hash_store.dirty = False
         html_path = Path(HTML_DIR)
         if html_path.exists():
             shutil.rmtree(html_path)
@@ -2,15 +2,50 @@ from __future__ import annotations
 
 import os
 import json
+import mmap
+import weakref
 from dataclasses import dataclass
-from typing import Iterable, List, Optional
+from typing import TYPE_CHECKING, Iterable, List, Optional
 
-import chromadb
 import numpy as np
-from sentence_transformers import SentenceTransformer
+
+# chromadb e sentence_transformers (che trascina torch) vengono importati
+# dentro get_chroma/get_model: chi usa solo Chunk/load_index non li paga
+if TYPE_CHECKING:
+    import chromadb
+    from sentence_transformers import SentenceTransformer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def json_loads(data):
+    """Parsa JSON con orjson se disponibile (parser C, ~3-6x piu veloce)."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def json_dumps_line(obj) -> bytes:
+    """Serializza una riga JSONL (newline inclusa) come bytes."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_APPEND_NEWLINE)
+    return (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def json_dumps_str(obj) -> str:
+    """Serializza JSON compatto come str (orjson se disponibile)."""
+    if orjson is not None:
+        return orjson.dumps(obj).decode("utf-8")
+    return json.dumps(obj, ensure_ascii=False)
 
 STORAGE_DIR = os.path.join(os.path.dirname(__file__), "storage")
 CHUNKS_PATH = os.path.join(STORAGE_DIR, "chunks.jsonl")
+EMBEDDINGS_PATH = os.path.join(STORAGE_DIR, "embeddings.npy")
+EMB_I8_PATH = os.path.join(STORAGE_DIR, "emb_i8.npy")
+EMB_SCALES_PATH = os.path.join(STORAGE_DIR, "emb_scales.npy")
 CHROMA_DIR = os.path.join(STORAGE_DIR, "chroma")
 CHROMA_COLLECTION = "manual_chunks"
 
@@ -21,13 +56,40 @@ _CHROMA_CLIENT: Optional[chromadb.PersistentClient] = None
 def get_model() -> SentenceTransformer:
     global _MODEL
     if _MODEL is None:
-        _MODEL = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        model_name = "sentence-transformers/all-MiniLM-L6-v2"
+        if torch.cuda.is_available():
+            _MODEL = SentenceTransformer(model_name, device="cuda")
+            # FP16 su GPU: dimezza la banda e raddoppia il throughput ALU
+            _MODEL.half()
+        else:
+            # Su host solo-CPU il backend ONNX Runtime (se installato con
+            # optimum) batte l'eager PyTorch di circa 2x sullo stesso modello
+            try:
+                import onnxruntime  # noqa: F401
+
+                # Un export int8 (optimum-cli onnxruntime quantize ...) sfrutta
+                # le istruzioni VNNI: ~2-4x sul CPU a pari qualita di retrieval
+                int8_dir = os.environ.get("RAG_ONNX_INT8_DIR")
+                if int8_dir and os.path.isdir(int8_dir):
+                    _MODEL = SentenceTransformer(int8_dir, device="cpu", backend="onnx")
+                else:
+                    _MODEL = SentenceTransformer(model_name, device="cpu", backend="onnx")
+            except ImportError:
+                # Solo dipendenze mancanti (onnxruntime/optimum) ricadono su
+                # PyTorch eager; gli errori reali del backend ONNX emergono
+                torch.set_num_threads(os.cpu_count() or 1)
+                _MODEL = SentenceTransformer(model_name, device="cpu")
     return _MODEL
 
 
 def get_chroma() -> chromadb.PersistentClient:
     global _CHROMA_CLIENT
     if _CHROMA_CLIENT is None:
+        import chromadb
+
         os.makedirs(CHROMA_DIR, exist_ok=True)
         _CHROMA_CLIENT = chromadb.PersistentClient(path=CHROMA_DIR)
     return _CHROMA_CLIENT
@@ -38,7 +100,7 @@ def get_collection() -> chromadb.Collection:
     return client.get_or_create_collection(name=CHROMA_COLLECTION)
 
 
-@dataclass
+@dataclass(slots=True)
 class Chunk:
     id: str
     brand: str
@@ -52,16 +114,18 @@ class Chunk:
 
     @staticmethod
     def from_json(data: dict) -> "Chunk":
+        # Costruzione posizionale: evita l'overhead del binding per keyword
+        # nel loop caldo di deserializzazione
         return Chunk(
-            id=data["id"],
-            brand=data["brand"],
-            manual=data["manual"],
-            page=int(data["page"]),
-            text=data["text"],
-            images=list(data.get("images", [])),
-            html_file=data.get("html_file", ""),
-            html_anchor=data.get("html_anchor", ""),
-            full_paragraph=data.get("full_paragraph", ""),
+            data["id"],
+            data["brand"],
+            data["manual"],
+            int(data["page"]),
+            data["text"],
+            list(data.get("images", [])),
+            data.get("html_file", ""),
+            data.get("html_anchor", ""),
+            data.get("full_paragraph", ""),
         )
 
     def to_json(self) -> dict:
@@ -80,33 +144,137 @@ class Chunk:
 
 def embed_texts(texts: Iterable[str]) -> np.ndarray:
     model = get_model()
-    embeddings = model.encode(list(texts), normalize_embeddings=True)
-    return np.asarray(embeddings, dtype=np.float32)
+    embeddings = model.encode(
+        list(texts),
+        batch_size=128,
+        normalize_embeddings=True,
+        convert_to_numpy=True,
+        show_progress_bar=False,
+    )
+    if embeddings.dtype != np.float32:
+        embeddings = embeddings.astype(np.float32)
+    return embeddings
+
+
+class Int8Embeddings:
+    """Matrice di embedding quantizzata a int8 con scala per riga.
+
+    Dimezza/quarta i byte letti per query rispetto a fp32: il prodotto
+    scalare resta memory-bound, quindi meno banda = meno latenza.
+    """
+
+    def __init__(self, codes: np.ndarray, scales: np.ndarray):
+        self.codes = codes
+        self.scales = scales
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    # Righe convertite per blocco: il temporaneo fp32 resta ~12 MB
+    BLOCK_ROWS = 8192
+
+    def scores(self, query_vec: np.ndarray) -> np.ndarray:
+        # Conversione a blocchi invece che dell'intera matrice: la memoria
+        # scorre i byte int8 una volta sola e il prodotto BLAS lavora su un
+        # temporaneo fp32 di dimensione costante, mantenendo il vantaggio
+        # di banda della quantizzazione
+        query = np.ascontiguousarray(query_vec, dtype=np.float32)
+        out = np.empty(len(self.codes), dtype=np.float32)
+        for start in range(0, len(self.codes), self.BLOCK_ROWS):
+            stop = start + self.BLOCK_ROWS
+            out[start:stop] = self.codes[start:stop].astype(np.float32) @ query
+        out *= self.scales
+        return out
+
+
+def quantize_embeddings(embeddings: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Quantizza (N, D) fp32 a int8 simmetrico con una scala per riga."""
+    if not len(embeddings):
+        return np.zeros((0, embeddings.shape[1] if embeddings.ndim == 2 else 384), dtype=np.int8), np.zeros(0, dtype=np.float32)
+    max_abs = np.max(np.abs(embeddings), axis=1)
+    max_abs[max_abs == 0] = 1.0
+    scales = (max_abs / 127.0).astype(np.float32)
+    codes = np.round(embeddings / scales[:, None]).astype(np.int8)
+    return codes, scales
+
+
+def _atomic_save(path: str, arr: np.ndarray) -> None:
+    """np.save su file temporaneo + os.replace atomico.
+
+    Il server tiene le matrici caricate mentre l'ingest in background le
+    riscrive: la sostituzione atomica evita che un lettore apra un file
+    troncato a metà scrittura (e su Windows non tocca mai un file mappato)."""
+    tmp = f"{path}.{os.getpid()}.tmp.npy"
+    np.save(tmp, arr)
+    os.replace(tmp, path)
+
+
+def _save_quantized(embeddings: np.ndarray, append: bool = False) -> None:
+    codes, scales = quantize_embeddings(embeddings)
+    if append and os.path.exists(EMB_I8_PATH) and os.path.exists(EMB_SCALES_PATH):
+        old_codes = np.load(EMB_I8_PATH)
+        old_scales = np.load(EMB_SCALES_PATH)
+        if old_codes.size:
+            codes = np.vstack([old_codes, codes])
+            scales = np.concatenate([old_scales, scales])
+    _atomic_save(EMB_I8_PATH, codes)
+    _atomic_save(EMB_SCALES_PATH, scales)
+
+
+_CHROMA_ADD_BATCH = 1000
+
+
+def _add_in_batches(collection, ids, documents, embeddings, metadatas) -> None:
+    """Inserisce in Chroma a blocchi, così il picco di memoria resta O(batch)
+    invece di O(corpus) e l'inserimento non passa un unico payload gigante."""
+    for start in range(0, len(ids), _CHROMA_ADD_BATCH):
+        stop = start + _CHROMA_ADD_BATCH
+        collection.add(
+            ids=ids[start:stop],
+            documents=documents[start:stop],
+            embeddings=embeddings[start:stop],
+            metadatas=metadatas[start:stop],
+        )
 
 
 def save_index(chunks: List[Chunk]) -> None:
     os.makedirs(STORAGE_DIR, exist_ok=True)
-    with open(CHUNKS_PATH, "w", encoding="utf-8") as f:
+    with open(CHUNKS_PATH, "wb") as f:
         for chunk in chunks:
-            f.write(json.dumps(chunk.to_json(), ensure_ascii=False) + "\n")
+            f.write(json_dumps_line(chunk.to_json()))
 
-    collection = get_collection()
+    # delete(where={}) scansiona e cancella riga per riga: per un reindex
+    # completo buttare la collection e ricrearla vuota è O(1)
+    client = get_chroma()
     try:
-        collection.delete(where={})
+        client.delete_collection(CHROMA_COLLECTION)
     except Exception:
         pass
+    collection = client.get_or_create_collection(
+        name=CHROMA_COLLECTION,
+        metadata={"hnsw:space": "cosine"},
+    )
 
     if not chunks:
+        # Azzera anche la matrice quantizzata: file residui del run
+        # precedente verrebbero estesi dai successivi add_to_index e
+        # resterebbero disallineati da chunks.jsonl per sempre
+        empty = np.zeros((0, 384), dtype=np.float32)
+        _atomic_save(EMBEDDINGS_PATH, empty)
+        _save_quantized(empty)
         return
 
     documents = [chunk.text for chunk in chunks]
     embeddings = embed_texts(documents)
+    # Matrice (N, D) allineata all'ordine di chunks.jsonl per la ricerca vettorizzata
+    _atomic_save(EMBEDDINGS_PATH, embeddings)
+    _save_quantized(embeddings)
     metadatas = [
         {
             "brand": chunk.brand,
             "manual": chunk.manual,
             "page": int(chunk.page),
-            "images": json.dumps(chunk.images, ensure_ascii=False),
+            "images": json_dumps_str(chunk.images),
             "html_file": chunk.html_file,
             "html_anchor": chunk.html_anchor,
         }
@@ -114,24 +282,130 @@ def save_index(chunks: List[Chunk]) -> None:
     ]
     ids = [chunk.id for chunk in chunks]
 
-    collection.add(
-        ids=ids,
-        documents=documents,
-        embeddings=embeddings.tolist(),
-        metadatas=metadatas,
-    )
+    _add_in_batches(collection, ids, documents, embeddings, metadatas)
+
+
+def add_to_index(chunks: List[Chunk]) -> None:
+    """Aggiunge nuovi chunk all'indice esistente senza riscrivere quelli già salvati."""
+    if not chunks:
+        return
 
+    os.makedirs(STORAGE_DIR, exist_ok=True)
+    with open(CHUNKS_PATH, "ab") as f:
+        for chunk in chunks:
+            f.write(json_dumps_line(chunk.to_json()))
+
+    documents = [chunk.text for chunk in chunks]
+    embeddings = embed_texts(documents)
+    if os.path.exists(EMBEDDINGS_PATH):
+        existing = np.load(EMBEDDINGS_PATH)
+        if existing.size:
+            embeddings_all = np.vstack([existing, embeddings])
+        else:
+            embeddings_all = embeddings
+    else:
+        embeddings_all = embeddings
+    _atomic_save(EMBEDDINGS_PATH, embeddings_all)
+    _save_quantized(embeddings, append=True)
+    metadatas = [
+        {
+            "brand": chunk.brand,
+            "manual": chunk.manual,
+            "page": int(chunk.page),
+            "images": json_dumps_str(chunk.images),
+            "html_file": chunk.html_file,
+            "html_anchor": chunk.html_anchor,
+        }
+        for chunk in chunks
+    ]
+    ids = [chunk.id for chunk in chunks]
 
-def load_index() -> tuple[List[Chunk], np.ndarray]:
-    if not os.path.exists(CHUNKS_PATH):
-        return [], np.zeros((0, 384), dtype=np.float32)
+    collection = get_collection()
+    _add_in_batches(collection, ids, documents, embeddings, metadatas)
+
+
+class LazyChunks:
+    """Vista lazy su chunks.jsonl: tiene in RAM solo gli offset di riga.
+
+    Il file viene mappato con mmap e ogni Chunk è deserializzato solo al
+    primo accesso, così il cold-start non paga il parse dell'intero corpus.
+    """
+
+    def __init__(self, path: str):
+        self._file = open(path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        data = np.frombuffer(self._mm, dtype=np.uint8)
+        newlines = np.flatnonzero(data == ord("\n"))
+        starts = np.concatenate(([0], newlines[:-1] + 1)) if len(newlines) else np.zeros(0, dtype=np.int64)
+        ends = newlines
+        if len(data) and (not len(newlines) or newlines[-1] != len(data) - 1):
+            # Ultima riga senza newline finale
+            starts = np.concatenate((starts, [newlines[-1] + 1 if len(newlines) else 0]))
+            ends = np.concatenate((ends, [len(data)]))
+        # Scarta le righe vuote
+        keep = ends > starts
+        self._starts = starts[keep].astype(np.int64)
+        self._ends = ends[keep].astype(np.int64)
+        self._cache: dict[int, Chunk] = {}
+        # Rilascio legato alla distruzione dell'oggetto: i lettori in volo
+        # (search sul threadpool) possono tenere un riferimento anche dopo
+        # che load_cache ha rimpiazzato l'istanza, quindi mmap e fd vanno
+        # chiusi solo quando l'ultimo riferimento sparisce
+        self._finalizer = weakref.finalize(self, self._release, self._mm, self._file)
 
-    chunks: List[Chunk] = []
-    with open(CHUNKS_PATH, "r", encoding="utf-8") as f:
-        for line in f:
-            if line.strip():
-                chunks.append(Chunk.from_json(json.loads(line)))
-    return chunks, np.zeros((0, 384), dtype=np.float32)
+    @staticmethod
+    def _release(mm: mmap.mmap, file) -> None:
+        mm.close()
+        file.close()
+
+    def __len__(self) -> int:
+        return len(self._starts)
+
+    def __getitem__(self, idx: int) -> Chunk:
+        chunk = self._cache.get(idx)
+        if chunk is None:
+            line = self._mm[self._starts[idx]:self._ends[idx]]
+            chunk = Chunk.from_json(json_loads(line))
+            self._cache[idx] = chunk
+        return chunk
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def close(self) -> None:
+        """Rilascia subito mmap e file handle (idempotente).
+
+        Da usare solo quando si è certi che nessun lettore tenga ancora
+        l'istanza; altrimenti il finalizer chiude tutto da sé alla
+        distruzione dell'oggetto."""
+        self._finalizer()
+
+
+def load_index() -> tuple[List[Chunk], np.ndarray | Int8Embeddings | None]:
+    if not os.path.exists(CHUNKS_PATH) or os.path.getsize(CHUNKS_PATH) == 0:
+        return [], None
+
+    chunks = LazyChunks(CHUNKS_PATH)
+
+    # None = nessuna matrice allineata disponibile: search ricade su Chroma
+    embeddings = None
+    # Preferisci la matrice quantizzata int8 (meno banda per query)
+    if os.path.exists(EMB_I8_PATH) and os.path.exists(EMB_SCALES_PATH):
+        # In RAM, non mmap: il file viene riscritto da add_to_index nello
+        # stesso processo e una mapping viva renderebbe la riscrittura
+        # un SIGBUS latente (o un errore secco su Windows)
+        codes = np.load(EMB_I8_PATH)
+        scales = np.load(EMB_SCALES_PATH)
+        if len(codes) == len(chunks) and len(scales) == len(codes):
+            return chunks, Int8Embeddings(codes, scales)
+    if os.path.exists(EMBEDDINGS_PATH):
+        candidate = np.load(EMBEDDINGS_PATH)
+        # Usa la matrice solo se allineata al file dei chunk
+        if len(candidate) == len(chunks):
+            embeddings = candidate
+
+    return chunks, embeddings
 
 
 def search(
@@ -145,11 +419,35 @@ def search(
         return []
 
     query_vec = embed_texts([query])[0]
+
+    # Percorso vettorizzato: un solo prodotto matrice-vettore BLAS su tutti i
+    # chunk, poi top-k con argpartition. Richiede la matrice allineata ai chunk.
+    if embeddings is not None and len(embeddings) == len(chunks):
+        if isinstance(embeddings, Int8Embeddings):
+            scores = embeddings.scores(query_vec)
+        else:
+            scores = np.asarray(embeddings @ query_vec, dtype=np.float32)
+        results: List[tuple[Chunk, float]] = []
+        if brand:
+            brand_lower = brand.lower()
+            for idx in np.argsort(-scores):
+                chunk = chunks[int(idx)]
+                if chunk.brand == brand_lower:
+                    results.append((chunk, float(scores[idx])))
+                    if len(results) >= top_k:
+                        break
+        else:
+            k = min(top_k, len(scores))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            results = [(chunks[int(idx)], float(scores[idx])) for idx in top]
+        return results
+
     collection = get_collection()
     where = {"brand": brand.lower()} if brand else None
 
     response = collection.query(
-        query_embeddings=[query_vec.tolist()],
+        query_embeddings=query_vec.reshape(1, -1),
         n_results=top_k,
         where=where,
         include=["metadatas", "documents", "distances"],
@@ -165,7 +463,7 @@ def search(
         images = []
         if meta and "images" in meta and meta["images"]:
             try:
-                images = json.loads(meta["images"])
+                images = json_loads(meta["images"])
             except Exception:
                 images = []
         chunk = Chunk(